@@ -0,0 +1,105 @@
+"""
+On the fly data augmentation for train.py.
+
+Every transform works on a whole batch at once, (N, height, width, 3) uint8
+frames and (N, 2) labels of [base_speed, direction]. The Augmenter is run
+by the BatchStream workers with a random state derived from the stream
+seed, the epoch and the batch number, so a run can be reproduced exactly.
+"""
+import cv2
+import numpy as np
+
+FLIP_PROBABILITY = 0.5
+BRIGHTNESS_RANGE = (0.6, 1.4)
+SHADOW_PROBABILITY = 0.3
+SHADOW_DARKNESS = (0.4, 0.8)
+TRANSLATE_PROBABILITY = 0.5
+MAX_TRANSLATION = 20  # pixels
+#direction correction per pixel of horizontal shift
+STEERING_PER_PIXEL = 0.004
+BLUR_PROBABILITY = 0.2
+BLUR_KERNEL = (5, 5)
+
+DIRECTION = 1  # label column of the steering command
+
+
+def flip(X, y, rng, probability):
+    """
+    Mirror frames left to right and negate their steering.
+    """
+    mask = rng.uniform(size=len(X)) < probability
+    X[mask] = X[mask, :, ::-1]
+    y[mask, DIRECTION] *= -1
+    return X, y
+
+
+def brightness_and_shadow(X, rng, brightness_range, shadow_probability, shadow_darkness):
+    """
+    Scale each frame's brightness and darken a random vertical band in some.
+    """
+    n, _, width, _ = X.shape
+    scale = rng.uniform(*brightness_range, size=(n, 1, 1))
+    shaded = rng.uniform(size=n) < shadow_probability
+    left = rng.randint(0, width, size=n)
+    right = rng.randint(0, width, size=n)
+    left, right = np.minimum(left, right), np.maximum(left, right)
+    columns = np.arange(width)
+    band = (columns >= left[:, None]) & (columns <= right[:, None]) & shaded[:, None]
+    darkness = rng.uniform(*shadow_darkness, size=(n, 1))
+    scale = scale * np.where(band, darkness, 1.0)[:, None, :]
+    out = X * scale[..., None].astype(np.float32)
+    np.clip(out, 0, 255, out=out)
+    X[:] = out
+    return X
+
+
+def translate(X, y, rng, probability, max_translation, steering_per_pixel):
+    """
+    Shift frames sideways, repeating the edge column, and correct steering:
+    a track that moves right in the picture needs a right turn.
+    """
+    n, _, width, _ = X.shape
+    shift = rng.randint(-max_translation, max_translation + 1, size=n)
+    shift[rng.uniform(size=n) >= probability] = 0
+    columns = np.clip(np.arange(width) - shift[:, None], 0, width - 1)
+    X[:] = np.take_along_axis(X, columns[:, None, :, None], axis=2)
+    y[:, DIRECTION] -= shift * steering_per_pixel
+    return X, y
+
+
+def blur(X, rng, probability, kernel):
+    for i in np.flatnonzero(rng.uniform(size=len(X)) < probability):
+        X[i] = cv2.GaussianBlur(X[i], kernel, 0)
+    return X
+
+
+class Augmenter():
+    """
+    Configurable chain of the augmentations above.
+    """
+    def __init__(self, flip_probability=FLIP_PROBABILITY,
+                 brightness_range=BRIGHTNESS_RANGE,
+                 shadow_probability=SHADOW_PROBABILITY,
+                 shadow_darkness=SHADOW_DARKNESS,
+                 translate_probability=TRANSLATE_PROBABILITY,
+                 max_translation=MAX_TRANSLATION,
+                 steering_per_pixel=STEERING_PER_PIXEL,
+                 blur_probability=BLUR_PROBABILITY, blur_kernel=BLUR_KERNEL):
+        self.flip_probability = flip_probability
+        self.brightness_range = brightness_range
+        self.shadow_probability = shadow_probability
+        self.shadow_darkness = shadow_darkness
+        self.translate_probability = translate_probability
+        self.max_translation = max_translation
+        self.steering_per_pixel = steering_per_pixel
+        self.blur_probability = blur_probability
+        self.blur_kernel = blur_kernel
+
+    def __call__(self, X, y, rng):
+        X, y = flip(X, y, rng, self.flip_probability)
+        X = brightness_and_shadow(X, rng, self.brightness_range,
+                                  self.shadow_probability, self.shadow_darkness)
+        X, y = translate(X, y, rng, self.translate_probability,
+                         self.max_translation, self.steering_per_pixel)
+        X = blur(X, rng, self.blur_probability, self.blur_kernel)
+        return X, y
@@ -0,0 +1,82 @@
+"""
+Joystick state to serial commands, kept apart from controller.py so it can
+be used and tested without pygame or a serial port.
+"""
+import wire_protocol
+
+MAX_RATE = 50  # commands per second while the stick moves
+HEARTBEAT_INTERVAL = 0.1  # seconds
+#the agent's HEARTBEAT_TIMEOUT (communications.py) must span at least this
+#many heartbeats, so a few lost packets do not stop the tank
+HEARTBEATS_PER_TIMEOUT = 3
+AGENT_HEARTBEAT_TIMEOUT = 0.5  # seconds
+MAX_HEARTBEAT_INTERVAL = AGENT_HEARTBEAT_TIMEOUT / HEARTBEATS_PER_TIMEOUT
+#stick readings this close to the center are sent as 0
+CENTER_DEADBAND = 0.05
+#smaller moves than this are left for the heartbeat to carry
+CHANGE_THRESHOLD = 0.02
+
+
+class CommandSender():
+    """
+    Sends the joystick state when it changes meaningfully, at most
+    max_rate times a second, and as a heartbeat every heartbeat_interval
+    seconds when it does not.
+    """
+    def __init__(self, write, protocol='json', max_rate=MAX_RATE,
+                 heartbeat_interval=HEARTBEAT_INTERVAL):
+        if heartbeat_interval > MAX_HEARTBEAT_INTERVAL:
+            raise ValueError('Heartbeat interval above {:.3f} s, the agent would '
+                             'drop the link'.format(MAX_HEARTBEAT_INTERVAL))
+        self.write = write
+        self.protocol = protocol
+        self.min_interval = 1.0 / max_rate
+        self.heartbeat_interval = heartbeat_interval
+        self.axes = [0.0, 0.0]
+        self.sent_axes = [0.0, 0.0]
+        self.flags = 0
+        self.last_send_time = float('-inf')
+        self.sequence = 0
+
+    def set_axis(self, index, value):
+        if abs(value) < CENTER_DEADBAND:
+            value = 0.0
+        self.axes[index] = value
+
+    def press(self, flag):
+        self.flags |= flag
+
+    def changed(self):
+        if self.flags:
+            return True
+        for value, sent in zip(self.axes, self.sent_axes):
+            #always let the stick returning to (or leaving) the center through
+            if abs(value - sent) > CHANGE_THRESHOLD or (value == 0) != (sent == 0):
+                return True
+        return False
+
+    def next_send_time(self):
+        if self.changed():
+            return self.last_send_time + self.min_interval
+        return self.last_send_time + self.heartbeat_interval
+
+    def poll(self, now):
+        if now < self.next_send_time():
+            return False
+        self.write(self.encode())
+        self.sent_axes = list(self.axes)
+        self.flags = 0
+        self.last_send_time = now
+        return True
+
+    def encode(self):
+        base_speed, rotation = self.axes
+        if self.protocol == 'binary':
+            frame = wire_protocol.encode_command(self.sequence, base_speed, rotation, self.flags)
+            self.sequence = (self.sequence + 1) % 256
+            return frame
+        message = '{"a":'+str(base_speed)+',"b":'+str(rotation)
+        for flag, name in wire_protocol.FLAG_NAMES:
+            if self.flags & flag:
+                message += ',"'+name+'":1'
+        return (message + '}').encode()
@@ -1,65 +1,85 @@
+import argparse
+import os
+import sys
+import time
+
 import serial
 import pygame
-import time
 
-pygame.init()
-clock = pygame.time.Clock()
-pygame.joystick.init()
+#the binary command frames are shared with the agent
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import command_sender
+import wire_protocol
+
 VERTICAL_AXIS_ID=1
 HORIZONTAL_AXIS_ID=3
 BUTTON_INDEX_X = 0
 BUTTON_INDEX_A = 1
 BUTTON_INDEX_B = 2
 BUTTON_INDEX_y = 3
+#buttons send a one shot flag when pressed
+BUTTON_FLAGS = {
+    BUTTON_INDEX_X: wire_protocol.FLAG_ENGAGE,
+    BUTTON_INDEX_B: wire_protocol.FLAG_DISENGAGE,
+    BUTTON_INDEX_A: wire_protocol.FLAG_SAVE,
+    BUTTON_INDEX_y: wire_protocol.FLAG_ERASE,
+}
+
+def handle_event(event, sender, joysticks):
+    if event.type == pygame.JOYDEVICEADDED:
+        #keep a reference, pygame stops reporting events for collected joysticks
+        joystick = pygame.joystick.Joystick(event.device_index)
+        joystick.init()
+        joysticks[joystick.get_instance_id()] = joystick
+        print('Joystick connected: {}'.format(joystick.get_name()))
+    elif event.type == pygame.JOYDEVICEREMOVED:
+        joysticks.pop(event.instance_id, None)
+        #stop the tank rather than repeating the last command
+        sender.set_axis(0, 0.0)
+        sender.set_axis(1, 0.0)
+        print('Joystick disconnected')
+    elif event.type == pygame.JOYAXISMOTION:
+        if event.axis == VERTICAL_AXIS_ID:
+            sender.set_axis(0, event.value)
+        elif event.axis == HORIZONTAL_AXIS_ID:
+            sender.set_axis(1, event.value)
+    elif event.type == pygame.JOYBUTTONDOWN and event.button in BUTTON_FLAGS:
+        sender.press(BUTTON_FLAGS[event.button])
 
-def get_joystick_axes():
-    for event in pygame.event.get(): # User did something.
-        continue
-    joystick = pygame.joystick.Joystick(0)
-    joystick.init()
-    base_speed = joystick.get_axis(VERTICAL_AXIS_ID)
-    rotation = joystick.get_axis(HORIZONTAL_AXIS_ID)
-    button_a = joystick.get_button(BUTTON_INDEX_A)
-    button_y = joystick.get_button(BUTTON_INDEX_y)
-    button_x = joystick.get_button(BUTTON_INDEX_X)
-    button_b = joystick.get_button(BUTTON_INDEX_B)
-    return  (base_speed, rotation, button_a, button_y, button_x, button_b)
 
-ser = serial.Serial('/dev/ttyUSB0', 115200)  # open serial port
-ser.write(b'B\n')     # Bypass an go into raw serial mode.
-print(ser.name)         # check which port was really used
-button_a_state = 0
-button_y_state = 0
-button_x_state = 0
-button_b_state = 0
-while True:
+def main():
+    parser = argparse.ArgumentParser()
+    #json is what older agents understand, binary is ~5x smaller and checksummed
+    parser.add_argument('--protocol', choices=('json', 'binary'), default='json')
+    parser.add_argument('--max-rate', type=float, default=command_sender.MAX_RATE,
+                        help='commands per second while the stick moves')
+    parser.add_argument('--heartbeat', type=float,
+                        default=command_sender.HEARTBEAT_INTERVAL,
+                        help='seconds between commands while the stick is still, '
+                             'at most {:.3f}'.format(command_sender.MAX_HEARTBEAT_INTERVAL))
+    args = parser.parse_args()
+    if args.heartbeat > command_sender.MAX_HEARTBEAT_INTERVAL:
+        parser.error('--heartbeat must be at most {:.3f} s, a third of the '
+                     "agent's heartbeat timeout".format(
+                         command_sender.MAX_HEARTBEAT_INTERVAL))
 
-    base_speed, rotation, button_a, button_y, button_x, button_b = get_joystick_axes()
-    append_message = ""
-    if button_x == 0:
-      button_x_state = 0
-    if button_x == 1 and button_x_state == 0:
-      button_x_state = 1
-      append_message += ',"engage":'+str(button_x)
-    if button_b == 0:
-      button_b_state = 0
-    if button_b == 1 and button_b_state == 0:
-      button_b_state = 1
-      append_message += ',"disengage":'+str(button_b)
-    
-    if button_a == 0:
-      button_a_state = 0
-    if button_a == 1 and button_a_state == 0:
-      button_a_state = 1
-      append_message += ',"save":'+str(button_a)
-    if button_y == 0:
-      button_y_state = 0
-    if button_y == 1 and button_y_state == 0:
-      button_y_state = 1
-      append_message += ',"erase":'+str(button_a)
+    pygame.init()
+    pygame.joystick.init()
+    ser = serial.Serial('/dev/ttyUSB0', 115200)  # open serial port
+    ser.write(b'B\n')     # Bypass an go into raw serial mode.
+    print(ser.name)         # check which port was really used
+    sender = command_sender.CommandSender(ser.write, args.protocol, args.max_rate, args.heartbeat)
+    joysticks = {}
+    try:
+        while True:
+            #sleep until the next event or until a command is due
+            timeout = max(0.0, sender.next_send_time() - time.monotonic())
+            event = pygame.event.wait(max(1, int(timeout * 1000)))
+            for event in [event] + pygame.event.get():
+                handle_event(event, sender, joysticks)
+            sender.poll(time.monotonic())
+    finally:
+        ser.close()
 
-    message = '{"a":'+str(base_speed)+',"b":'+str(rotation)+ append_message + '}'
-      
-    ser.write(message.encode())     # write a string
-    time.sleep(0.05)
-ser.close()       
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Streaming input pipeline for train.py.
+
+Recorded sessions are discovered on disk and read lazily through memory
+maps or per frame decoding, so the dataset never has to fit in RAM. Batches
+are shuffled through a bounded buffer and assembled by background workers
+ahead of model.fit.
+"""
+import collections
+import concurrent.futures
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+
+#the recording format and preprocessing live next to the agent code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import dataset
+import preprocessing
+
+BATCH_SIZE = 32
+SHUFFLE_BUFFER = 2048
+WORKERS = 4
+PREFETCH_BATCHES = 8
+VALIDATION_FRACTION = 0.05
+LEGACY_PATTERN = 'x_train_set*.npy'
+
+#a contiguous range of frames of one session
+Segment = collections.namedtuple('Segment', ['session', 'start', 'stop'])
+
+
+class LegacySession():
+    """
+    x_train_set/y_train_set pair written by older agents, memory mapped.
+    """
+    def __init__(self, x_path, y_path):
+        self.path = x_path
+        self.frames_array = np.load(x_path, mmap_mode='r')
+        self.labels = np.load(y_path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.frames_array)
+
+    def __getitem__(self, i):
+        return self.frames_array[i]
+
+
+def discover_sessions(data_dirs):
+    """
+    Every recorded session found in data_dirs, new format and legacy pairs.
+    """
+    sessions = []
+    for data_dir in data_dirs:
+        for path in dataset.find_sessions(data_dir):
+            sessions.append(dataset.SessionReader(path))
+        for x_path in sorted(glob.glob(os.path.join(data_dir, LEGACY_PATTERN))):
+            y_path = os.path.join(data_dir, os.path.basename(x_path).replace('x_train_set', 'y_train_set', 1))
+            if os.path.exists(y_path):
+                sessions.append(LegacySession(x_path, y_path))
+    return [session for session in sessions if len(session)]
+
+
+def split_sessions(sessions, validation_fraction=VALIDATION_FRACTION, seed=0):
+    """
+    Split train/validation by whole sessions so validation frames are never
+    neighbours of training frames. When no session is small enough the last
+    frames of the smallest session are held out instead.
+    """
+    if not sessions:
+        raise ValueError('No recorded sessions found.')
+    total = sum(len(session) for session in sessions)
+    wanted = max(1, int(round(total * validation_fraction)))
+    order = np.random.RandomState(seed).permutation(len(sessions))
+    train, valid = [], []
+    held_out = 0
+    for index in order:
+        session = sessions[index]
+        fits = held_out + len(session) <= 2 * wanted
+        if held_out < wanted and fits and len(valid) < len(sessions) - 1:
+            valid.append(Segment(session, 0, len(session)))
+            held_out += len(session)
+        else:
+            train.append(Segment(session, 0, len(session)))
+    if not valid:
+        #hold out the tail of the smallest session, keep every other session
+        session = min(sessions, key=len)
+        cut = max(1, len(session) - wanted)
+        if cut >= len(session):
+            raise ValueError('Not enough frames to hold out for validation.')
+        train = [Segment(session, 0, cut) if segment.session is session else segment
+                 for segment in train]
+        valid = [Segment(session, cut, len(session))]
+    return train, valid
+
+
+class BatchStream():
+    """
+    Batches of (frames, labels) from a list of segments. Frame order is
+    shuffled with a bounded buffer, batches are read, preprocessed and passed
+    through `transform(X, y, rng)` (e.g. augmentation) by a pool of workers
+    and up to `prefetch` of them are kept ready.
+    """
+    def __init__(self, segments, batch_size=BATCH_SIZE, shuffle=True,
+                 shuffle_buffer=SHUFFLE_BUFFER, workers=WORKERS,
+                 prefetch=PREFETCH_BATCHES, seed=0, transform=None):
+        self.segments = segments
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.seed = seed
+        self.transform = transform
+        self.preprocess = preprocessing.Preprocessor()
+        self.frames = sum(segment.stop - segment.start for segment in segments)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+    def __len__(self):
+        return math.ceil(self.frames / self.batch_size)
+
+    def _frame_order(self, rng):
+        segments = self.segments
+        if not self.shuffle:
+            for segment in segments:
+                for i in range(segment.start, segment.stop):
+                    yield segment.session, i
+            return
+        segments = [segments[i] for i in rng.permutation(len(segments))]
+        buffer = []
+        for segment in segments:
+            for i in range(segment.start, segment.stop):
+                buffer.append((segment.session, i))
+                if len(buffer) >= self.shuffle_buffer:
+                    j = rng.randint(len(buffer))
+                    buffer[j], buffer[-1] = buffer[-1], buffer[j]
+                    yield buffer.pop()
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _index_batches(self, rng):
+        batch = []
+        for item in self._frame_order(rng):
+            batch.append(item)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _load(self, batch, batch_seed):
+        X = np.empty((len(batch), *self.preprocess.output_shape), dtype=np.uint8)
+        y = np.empty((len(batch), dataset.LABEL_SIZE), dtype=np.float32)
+        for row, (session, i) in enumerate(batch):
+            self.preprocess(session[i], out=X[row])
+            y[row] = session.labels[i]
+        if self.transform is not None:
+            #seeded per batch so results do not depend on worker scheduling
+            X, y = self.transform(X, y, np.random.RandomState(batch_seed))
+        return X, y
+
+    def epoch(self, epoch=0):
+        """
+        One pass over every frame, batches come out in order.
+        """
+        rng = np.random.RandomState(self.seed + epoch)
+        pending = collections.deque()
+        for number, batch in enumerate(self._index_batches(rng)):
+            batch_seed = [self.seed, epoch, number]
+            pending.append(self.executor.submit(self._load, batch, batch_seed))
+            if len(pending) >= self.prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def repeat(self):
+        """
+        Endless stream of epochs, what model.fit expects from a generator.
+        """
+        epoch = 0
+        while True:
+            yield from self.epoch(epoch)
+            epoch += 1
+
+    def close(self):
+        self.executor.shutdown(wait=False)
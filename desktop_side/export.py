@@ -0,0 +1,154 @@
+"""
+Export a trained model.h5 to a TensorFlow Lite artifact for the Pi.
+
+    python3 export.py model.h5 --quantization int8 [data_dir ...]
+
+Writes model_<quantization>.tflite and a model_<quantization>.json report
+with the accuracy drift against the float Keras model on recorded frames
+and the measured per frame latency on this CPU. Copy the .tflite file to the
+Pi and point the agent (local inference) or model_server.py at it. To
+measure the latency on the Pi itself run there:
+
+    python3 export.py --benchmark model_int8.tflite
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+#finds the recorded sessions, also puts the agent code on the path
+import data_pipeline
+import inference
+import preprocessing
+
+QUANTIZATIONS = ('float32', 'float16', 'int8')
+CALIBRATION_FRAMES = 200
+EVALUATION_FRAMES = 500
+BENCHMARK_RUNS = 200
+WARMUP_RUNS = 10
+
+
+def sample_frames(sessions, count, seed):
+    """
+    Up to `count` preprocessed frames and labels picked evenly at random
+    over all sessions.
+    """
+    index = [(session, i) for session in sessions for i in range(len(session))]
+    rng = np.random.RandomState(seed)
+    picked = rng.choice(len(index), size=min(count, len(index)), replace=False)
+    preprocess = preprocessing.Preprocessor()
+    X = np.empty((len(picked), *preprocess.output_shape), dtype=np.uint8)
+    y = np.empty((len(picked), 2), dtype=np.float32)
+    for row, i in enumerate(picked):
+        session, frame = index[i]
+        preprocess(session[frame], out=X[row])
+        y[row] = session.labels[frame]
+    return X, y
+
+
+def convert(model, quantization, calibration_frames):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        def representative_dataset():
+            for frame in calibration_frames:
+                yield [frame[np.newaxis].astype(np.float32)]
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        #camera pixels go in as they are, predictions come out as float
+        converter.inference_input_type = tf.uint8
+    return converter.convert()
+
+
+def drift_report(reference, predicted, y):
+    """
+    How far the exported model strays from the float model, and how both do
+    against the human labels.
+    """
+    error = np.abs(predicted - reference)
+    report = {'frames': len(reference),
+              'mean_abs_drift': error.mean(axis=0).tolist(),
+              'max_abs_drift': error.max(axis=0).tolist(),
+              'float_mse_vs_labels': float(np.mean((reference - y) ** 2)),
+              'exported_mse_vs_labels': float(np.mean((predicted - y) ** 2))}
+    #does the tank still turn the same way
+    same_direction = np.sign(predicted[:, 1]) == np.sign(reference[:, 1])
+    report['direction_sign_agreement'] = float(same_direction.mean())
+    return report
+
+
+def benchmark(predictor, frames, runs=BENCHMARK_RUNS, warmup=WARMUP_RUNS):
+    """
+    Per frame latency of single frame predictions, in milliseconds.
+    """
+    for i in range(warmup):
+        predictor(frames[i % len(frames)][np.newaxis])
+    timings = np.empty(runs)
+    for i in range(runs):
+        frame = frames[i % len(frames)][np.newaxis]
+        start = time.perf_counter()
+        predictor(frame)
+        timings[i] = time.perf_counter() - start
+    timings *= 1000.0
+    return {'runs': runs,
+            'mean_ms': float(timings.mean()),
+            'p50_ms': float(np.percentile(timings, 50)),
+            'p95_ms': float(np.percentile(timings, 95)),
+            'p99_ms': float(np.percentile(timings, 99)),
+            'max_fps': float(1000.0 / timings.mean())}
+
+
+def export(model_filename, quantization, data_dirs, output_dir='.'):
+    from tensorflow.keras.models import load_model
+    sessions = data_pipeline.discover_sessions(data_dirs)
+    calibration, _ = sample_frames(sessions, CALIBRATION_FRAMES, seed=0)
+    X, y = sample_frames(sessions, EVALUATION_FRAMES, seed=1)
+
+    model = load_model(model_filename)
+    name = os.path.splitext(os.path.basename(model_filename))[0]
+    artifact = os.path.join(output_dir, '{}_{}.tflite'.format(name, quantization))
+    with open(artifact, 'wb') as f:
+        f.write(convert(model, quantization, calibration))
+
+    predictor = inference.load_predictor(artifact)
+    reference = np.asarray(model.predict(X.astype(np.float32)))
+    predicted = predictor(X)
+    report = {'source': model_filename,
+              'artifact': artifact,
+              'quantization': quantization,
+              'size_bytes': os.path.getsize(artifact),
+              'drift': drift_report(reference, predicted, y),
+              'latency': benchmark(predictor, X)}
+    report_filename = os.path.splitext(artifact)[0] + '.json'
+    with open(report_filename, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='model.h5 to export, or the .tflite to benchmark')
+    parser.add_argument('data_dirs', nargs='*', default=['.'],
+                        help='directories holding session_* recordings')
+    parser.add_argument('--quantization', choices=QUANTIZATIONS, default='int8')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='only measure the latency of an exported model')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        predictor = inference.load_predictor(args.model)
+        shape = preprocessing.Preprocessor().output_shape
+        frames = np.random.RandomState(0).randint(0, 255, (8, *shape)).astype(np.uint8)
+        report = benchmark(predictor, frames)
+    else:
+        report = export(args.model, args.quantization, args.data_dirs)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,6 @@
 #https://github.com/naokishibuya/car-behavioral-cloning/blob/master/model.py
 
 import numpy as np #matrix math
-from sklearn.model_selection import train_test_split #to split out training and testing data 
 #keras is a high level wrapper on top of tensorflow (machine learning library)
 #The Sequential container is a linear stack of layers
 from tensorflow.keras.models import Sequential
@@ -10,27 +9,31 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.optimizers import Adam
 #what types of layers do we want our model to have?
 from tensorflow.keras.layers import Lambda, Conv2D, MaxPooling2D, Dropout, Dense, Flatten
-import os
+import argparse
+#streams the recorded sessions from disk, also puts the agent code on the path
+import data_pipeline
+import augmentation
+import preprocessing
 
 #for debugging, allows for reproducible (deterministic) results 
 np.random.seed(0)
 
 
-def load_data():
+def load_data(data_dirs=('.',)):
     """
-    Load training data and split it into training and validation set
+    Find every recorded session and split them into a training and a
+    validation stream. Frames are read lazily, the data never has to fit in RAM.
     """
-    #yay dataframes, we can select rows and columns by their names
-    #we'll store the camera images as our input data
-    X = np.load('x_train_set.npy', allow_pickle=True)
-    #and our steering commands as our output data
-    y = np.load('y_train_set.npy', allow_pickle=True)
+    sessions = data_pipeline.discover_sessions(data_dirs)
+    print('Found {} sessions, {} frames'.format(len(sessions), sum(len(session) for session in sessions)))
+    #validation is held out by whole sessions, neighbouring frames are nearly identical
+    train_segments, valid_segments = data_pipeline.split_sessions(sessions, seed=0)
 
-    #now we can split the data into a training (80), testing(20), and validation set
-    #thanks scikit learn
-    X_train, X_valid, y_train, y_valid = train_test_split(X, y, test_size=0.05, random_state=0)
-
-    return X_train, X_valid, y_train, y_valid
+    #only the training frames are augmented, validation sees what the tank sees
+    train_stream = data_pipeline.BatchStream(train_segments, batch_size=5, seed=0,
+                                             transform=augmentation.Augmenter())
+    valid_stream = data_pipeline.BatchStream(valid_segments, batch_size=5, shuffle=False)
+    return train_stream, valid_stream
 
 
 def build_model():
@@ -54,7 +57,8 @@ def build_model():
     ELU(Exponential linear unit) function takes care of the Vanishing gradient problem. 
     """
     model = Sequential()
-    model.add(Lambda(lambda x: x/127.5-1.0, input_shape=(320, 180, 3)))
+    #same scaling as preprocessing.normalize, kept literal so model.h5 loads without this repo
+    model.add(Lambda(lambda x: x/127.5-1.0, input_shape=preprocessing.Preprocessor().output_shape))
     model.add(Conv2D(24, (5, 5), activation='elu', strides=(2, 2)))
     model.add(Conv2D(36, (5, 5), activation='elu', strides=(2, 2)))
     model.add(Conv2D(48, (5, 5), activation='elu', strides=(2, 2)))
@@ -71,7 +75,7 @@ def build_model():
     return model
 
 
-def train_model(model,  X_train, X_valid, Y_train, Y_valid):
+def train_model(model, train_stream, valid_stream):
     """
     Train the model
     """
@@ -89,13 +93,19 @@ def train_model(model,  X_train, X_valid, Y_train, Y_valid):
     #For instance, this allows you to do real-time data augmentation on images on CPU in 
     #parallel to training your model on GPU.
     #so we reshape our data into their appropriate batches and train our model simulatenously
-    model.fit(x = X_train, y = Y_train,validation_data=( X_valid, Y_valid), batch_size=5, epochs=20,verbose=1)
+    model.fit(train_stream.repeat(), steps_per_epoch=len(train_stream),
+              validation_data=valid_stream.repeat(), validation_steps=len(valid_stream),
+              epochs=20, verbose=1)
 
 
 def main():
-   
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dirs', nargs='*', default=['.'],
+                        help='directories holding session_* recordings')
+    args = parser.parse_args()
+
     #load data
-    data = load_data()
+    data = load_data(args.data_dirs)
     #build model
     model = build_model()
     #train model on data, it saves as model.h5 
@@ -1,11 +1,29 @@
 import asyncio
 import logging
+import logging.handlers
+import queue
+import signal
+import frame_bus
+import metrics
 import robot_lib
+import scheduler
 
+METRICS_FILENAME = 'metrics.json'
+# Ticks per second, both capped by the camera frame rate.
+COLLECT_RATE = 5
+AUTOPILOT_RATE = 30
+# Set to e.g. 'debug_frame.jpg' to keep the robot's view on disk.
+DEBUG_FRAME_FILENAME = None
 
-logging.basicConfig(filename='robot_lib.log',
-                    level=logging.DEBUG,
-                    format='%(asctime)s %(message)s')
+# Log records are queued and written to the SD card by a listener thread,
+# the event loop never waits on file I/O.
+log_queue = queue.SimpleQueue()
+log_file = logging.FileHandler('robot_lib.log')
+log_file.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_file)
+logging.basicConfig(level=logging.DEBUG,
+                    handlers=[logging.handlers.QueueHandler(log_queue)])
+log_listener.start()
 
 logging.info('----------------------')
 logging.info('Start of log')
@@ -15,19 +33,17 @@ robot = robot_lib.Robot()
 
 
 async def collect_data():
-    while True:
-        if not robot.autopilot_engaged:
-            await robot.collect_data()
-        await asyncio.sleep(0.2)
+    collect_scheduler = scheduler.Scheduler('collect', COLLECT_RATE)
+    await collect_scheduler.run(robot.collect_data,
+                                lambda: not robot.autopilot_engaged)
 
 
 async def autopilot():
-    while True:
-        if not robot.autopilot_engaged:
-            await asyncio.sleep(0.5)
-            continue
-        await robot.autopilot()
-        await asyncio.sleep(0.1)
+    autopilot_scheduler = scheduler.Scheduler('autopilot', AUTOPILOT_RATE)
+    # A failed step must not leave the motors on the last prediction.
+    await autopilot_scheduler.run(robot.autopilot,
+                                  lambda: robot.autopilot_engaged,
+                                  on_error=robot.stop)
 
 
 async def get_messages():
@@ -36,11 +52,33 @@ async def get_messages():
         await robot.process_events()
 
 
+def task_done(task):
+    # Only t1 is awaited, the other tasks would otherwise die silently.
+    if task.cancelled() or task.exception() is None:
+        return
+    logging.info('Task {} failed: {!r}'.format(task, task.exception()))
+    robot.stop()
+
+
 async def main(loop):
+    # Metrics are flushed periodically, `kill -USR1` writes them right away.
+    loop.add_signal_handler(signal.SIGUSR1, metrics.registry.write,
+                            METRICS_FILENAME)
     t1 = loop.create_task(get_messages())
     t2 = loop.create_task(collect_data())
     t3 = loop.create_task(autopilot())
-    await t1
+    t4 = loop.create_task(metrics.registry.report_periodically(METRICS_FILENAME))
+    if DEBUG_FRAME_FILENAME:
+        debug_sink = frame_bus.DebugSink(robot.frame_bus.subscribe('debug'),
+                                         DEBUG_FRAME_FILENAME)
+        t5 = loop.create_task(debug_sink.run())
+        t5.add_done_callback(task_done)
+    for task in (t2, t3, t4):
+        task.add_done_callback(task_done)
+    try:
+        await t1
+    finally:
+        await robot.close()
 
 try:
     loop = asyncio.get_event_loop()
@@ -48,7 +86,9 @@ try:
 except:
     robot.cleanup()
     loop.close()
+    log_listener.stop()
     raise
 
 robot.cleanup()
+log_listener.stop()
 
@@ -0,0 +1,91 @@
+import asyncio
+import concurrent.futures
+import logging
+
+import numpy as np
+
+MAX_BATCH_SIZE = 8
+MAX_WAIT = 0.005  # seconds
+
+
+# Collects frames from any number of concurrent callers into small batches.
+# A batch is run as soon as it is full or the oldest frame in it has waited
+# max_wait, each caller gets back its own row of the prediction. The model
+# runs on a single worker thread so the next batch is collected meanwhile.
+class MicroBatcher():
+    def __init__(self, predict, max_batch_size=MAX_BATCH_SIZE,
+                 max_wait=MAX_WAIT):
+        self.predict_batch = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.frame_queued = asyncio.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.executor.shutdown(wait=False)
+
+    async def predict(self, frame):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((frame, future))
+        self.frame_queued.set()
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            # Waiting on an event rather than on queue.get() means a timeout
+            # can never swallow a frame.
+            self.frame_queued.clear()
+            try:
+                await asyncio.wait_for(self.frame_queued.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        frames = np.stack([frame for frame, _ in batch])
+        try:
+            rows = await loop.run_in_executor(
+                self.executor, self.predict_batch, frames)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+
+    async def run(self):
+        while True:
+            batch = await self._collect()
+            # Callers may send different shapes, only stack alike frames.
+            by_shape = {}
+            for item in batch:
+                by_shape.setdefault(item[0].shape, []).append(item)
+            for same_shape in by_shape.values():
+                logging.debug('Running batch of {}'.format(len(same_shape)))
+                await self._run_batch(same_shape)
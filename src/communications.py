@@ -1,16 +1,77 @@
 import asyncio
+import collections
 import json
 import logging
+import time
 
 import aioserial
 
+import metrics
+import wire_protocol
 
 SERIAL_DEVICE = '/dev/ttyUSB0'
 BAUD_RATE = 115200
 BYPASS_COMMAND = b'B\n'
+# 'json', 'binary' (see wire_protocol) or 'auto' to follow whichever the
+# controller speaks.
+PROTOCOL = 'auto'
+PROTOCOLS = ('auto', 'json', 'binary')
+# Without a valid message for this long the connection counts as lost. The
+# controller sends a heartbeat every 0.1 s even when the stick is still, so
+# four lost packets in a row are tolerated.
+HEARTBEAT_TIMEOUT = 0.5  # seconds
+READ_RETRY_DELAY = 0.1  # seconds
+# One-shot commands, queued in order. Everything else in a message is part
+# of the drive command, of which only the latest matters.
+EVENT_KEYS = ('engage', 'disengage', 'save', 'erase')
 
 
+MESSAGE_START = b'{'
+MESSAGE_END = b'}'
+MAX_BUFFER = 1024  # bytes
+
+
+# Incremental framing over raw serial bytes. feed() appends a read to the
+# buffer and returns every complete message in it, searching with
+# bytearray.find instead of walking the buffer in Python. Garbage before a
+# message and truncated messages are skipped, and the buffer never grows
+# past max_buffer.
 class MessageParser():
+    def __init__(self, max_buffer=MAX_BUFFER):
+        self.buffer = bytearray()
+        self.max_buffer = max_buffer
+        self.discarded = 0
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        position = 0
+        while True:
+            start = buffer.find(MESSAGE_START, position)
+            if start < 0:
+                self.discarded += len(buffer) - position
+                position = len(buffer)
+                break
+            end = buffer.find(MESSAGE_END, start + 1)
+            if end < 0:
+                self.discarded += start - position
+                position = start
+                break
+            # A second start before the end means the first message was cut
+            # short, resynchronize on the later one.
+            restart = buffer.rfind(MESSAGE_START, start + 1, end)
+            if restart >= 0:
+                start = restart
+            self.discarded += start - position
+            messages.append(bytes(buffer[start:end + 1]))
+            position = end + 1
+        del buffer[:position]
+        if len(buffer) > self.max_buffer:
+            self.discarded += len(buffer)
+            buffer.clear()
+        return messages
+
     def proccess_message(self, message):
         try:
             message_dict = json.loads(message)
@@ -19,61 +80,153 @@ class MessageParser():
         return message_dict
 
     def proccess_raw_message(self, raw_message):
-        message = ''
-        remainder_raw = ''
-        index = 0
-        started = False
-        start_index = None
-        message_complete = False
-        for char in raw_message:
-            if not started and char == '{':
-                started = True
-                start_index = index
-            if started and char == '}':
-                message_complete = True
-                end_index = index
-                break
-            index += 1
-        if message_complete:
-            message = raw_message[start_index:end_index + 1]
-            remainder_raw = raw_message[end_index + 1:]
-        return message_complete, message, remainder_raw
+        start_index = raw_message.find('{')
+        if start_index < 0:
+            return False, '', ''
+        end_index = raw_message.find('}', start_index)
+        if end_index < 0:
+            return False, '', ''
+        message = raw_message[start_index:end_index + 1]
+        remainder_raw = raw_message[end_index + 1:]
+        return True, message, remainder_raw
 
 
 class Communications():
-    def __init__(self, serial_device=SERIAL_DEVICE, baud=BAUD_RATE):
+    def __init__(self, serial_device=SERIAL_DEVICE, baud=BAUD_RATE,
+                 protocol=PROTOCOL):
+        if protocol not in PROTOCOLS:
+            raise ValueError('Unknown protocol: {}'.format(protocol))
         self.ser = aioserial.AioSerial(
             serial_device, baud)    # open serial port
         logging.info('Attached to serial port: {}'.format(self.ser.name))
         # Bypass an go into raw serial mode.
         self.ser.write(BYPASS_COMMAND)
         logging.info('Entered Bypass mode')
-        self.raw_message = ''
+        self.protocol = protocol
         self.parser = MessageParser()
+        self.binary_parser = wire_protocol.BinaryParser()
+        # Filled by the reader task, emptied by get_message.
+        self.latest_command = None
+        self.events = collections.deque()
+        self.last_message_time = None
+        self.reader_task = None
+        self.message_ready = None
+        self.parse_time = metrics.histogram('serial.parse')
+        self.messages = metrics.counter('serial.messages')
+        self.bad_messages = metrics.counter('serial.bad_messages')
+        self.coalesced_commands = metrics.counter('serial.coalesced_commands')
+        self.read_errors = metrics.counter('serial.read_errors')
+        metrics.gauge('serial.discarded_bytes', lambda: self.parser.discarded)
+        metrics.gauge('serial.crc_errors', lambda: self.binary_parser.crc_errors)
+        metrics.gauge('serial.dropped_packets', lambda: self.binary_parser.dropped)
 
     def cleanup(self):
         logging.info('Closing serial device.')
         self.ser.close()
 
-    async def _get_message(self):
-        try:
-            raw_message = await self.ser.read_until_async(expected=b'}')
-            self.raw_message += raw_message.decode()
-        except UnicodeDecodeError:
-            pass
+    async def _read(self):
+        # Wait for one byte, then take whatever else already arrived.
+        data = await self.ser.read_async(1)
+        waiting = self.ser.in_waiting
+        if waiting:
+            data += self.ser.read(waiting)
+        return data
 
-        ready, message, remainder_raw = self.parser.proccess_raw_message(
-            self.raw_message)
+    def start(self):
+        # The reader runs for as long as the event loop does, so a timeout
+        # never cancels a read halfway through a message.
+        if self.reader_task is None or self.reader_task.done():
+            self.message_ready = asyncio.Event()
+            self.reader_task = asyncio.ensure_future(self._read_loop())
 
-        if ready:
+    async def _read_loop(self):
+        while True:
+            try:
+                data = await self._read()
+            except Exception as error:
+                self.read_errors.inc()
+                logging.info('Serial read failed: {}'.format(error))
+                await asyncio.sleep(READ_RETRY_DELAY)
+                continue
+            with self.parse_time.time():
+                for message_dict in self.decode(data):
+                    self._store(message_dict)
+
+    def _store(self, message_dict):
+        if not message_dict:
+            self.message_ready.set()
+            return
+        self.last_message_time = time.monotonic()
+        command = {}
+        for key, value in message_dict.items():
+            if key in EVENT_KEYS:
+                self.events.append({key: value})
+            else:
+                command[key] = value
+        if command:
+            if self.latest_command is not None:
+                self.coalesced_commands.inc()
+            self.latest_command = command
+        self.message_ready.set()
+
+    def _take_message(self):
+        message_dict = {}
+        if self.latest_command is not None:
+            message_dict.update(self.latest_command)
+            self.latest_command = None
+        # One event per message keeps them in the order they were sent.
+        if self.events:
+            message_dict.update(self.events.popleft())
+        if not self.events:
+            self.message_ready.clear()
+        return message_dict
+
+    def _decode_json(self, data):
+        message_dicts = []
+        for message in self.parser.feed(data):
             message_dict = self.parser.proccess_message(message)
-            self.raw_message = remainder_raw
-            return message_dict
+            self.messages.inc()
+            if not message_dict:
+                self.bad_messages.inc()
+            message_dicts.append(message_dict)
+        return message_dicts
+
+    def _decode_binary(self, data):
+        message_dicts = self.binary_parser.feed(data)
+        self.messages.inc(len(message_dicts))
+        return message_dicts
+
+    def decode(self, data):
+        if self.protocol == 'json':
+            return self._decode_json(data)
+        if self.protocol == 'binary':
+            return self._decode_binary(data)
+        # Binary frames may contain '{' and '}' bytes, so only a frame with a
+        # valid CRC or a JSON message that parses settles the protocol.
+        message_dicts = self._decode_binary(data)
+        if message_dicts:
+            self.protocol = 'binary'
         else:
-            return {}
+            message_dicts = self._decode_json(data)
+            if any(message_dicts):
+                self.protocol = 'json'
+        if self.protocol != 'auto':
+            logging.info('Controller speaks {}'.format(self.protocol))
+        return message_dicts
 
-    async def get_message(self, timeout=0.2):
+    async def get_message(self, timeout=HEARTBEAT_TIMEOUT):
+        # Returns the latest drive command merged with the oldest pending
+        # event, or {} after a message that could not be parsed. Raises if
+        # no valid message arrived within timeout of the last one.
+        self.start()
+        now = time.monotonic()
+        deadline = now + timeout
+        if self.last_message_time is not None and \
+                self.last_message_time + timeout > now:
+            deadline = self.last_message_time + timeout
         try:
-            return await asyncio.wait_for(self._get_message(), timeout=timeout)
+            await asyncio.wait_for(self.message_ready.wait(),
+                                   timeout=deadline - now)
         except asyncio.TimeoutError:
             raise Exception('Timed out getting message.')
+        return self._take_message()
@@ -0,0 +1,192 @@
+import glob
+import json
+import os
+
+import cv2
+import numpy as np
+
+METADATA_FILENAME = 'session.json'
+FRAMES_FILENAME = 'frames.bin'
+INDEX_FILENAME = 'index.npy'
+LABELS_FILENAME = 'labels.npy'
+TIMESTAMPS_FILENAME = 'timestamps.npy'
+SESSION_PATTERN = 'session_*'
+CHUNK_FRAMES = 256
+LABEL_SIZE = 2  # base_speed, direction
+
+# 'raw' keeps uncompressed frames in memory mapped chunks, the others store
+# each frame encoded back to back in frames.bin with an offset index.
+CODECS = {
+    'raw': None,
+    'png': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 1]),
+    'jpeg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 95]),
+}
+# Lossless, so the model trains on the pixels the camera delivered.
+CODEC = 'png'
+
+
+def chunk_filenames(index):
+    return ('frames_{:05d}.npy'.format(index),
+            'labels_{:05d}.npy'.format(index),
+            'timestamps_{:05d}.npy'.format(index),
+            'ends_{:05d}.npy'.format(index))
+
+
+# Writes one session. Labels, timestamps and raw frames (or the end offsets
+# of encoded frames) go to preallocated memory mapped chunks, so memory use
+# does not grow with the session. close() writes the columnar label and
+# timestamp tables, the frame index and the metadata.
+class SessionWriter():
+    def __init__(self, path, frame_shape, codec=CODEC,
+                 chunk_frames=CHUNK_FRAMES):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec: {}'.format(codec))
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.codec = codec
+        self.chunk_frames = chunk_frames
+        self.chunk = None
+        self.chunk_counts = []
+        self.frames_file = None
+        self.offset = 0
+        os.makedirs(path, exist_ok=True)
+        if CODECS[codec] is not None:
+            self.frames_file = open(os.path.join(path, FRAMES_FILENAME), 'wb')
+
+    def __len__(self):
+        return sum(self.chunk_counts)
+
+    def _open_memmap(self, filename, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(self.path, filename),
+                                         mode='w+', dtype=dtype, shape=shape)
+
+    def _open_chunk(self):
+        frames_name, labels_name, timestamps_name, ends_name = \
+            chunk_filenames(len(self.chunk_counts))
+        if self.frames_file is None:
+            frames = self._open_memmap(frames_name, np.uint8,
+                                       (self.chunk_frames, *self.frame_shape))
+        else:
+            frames = self._open_memmap(ends_name, np.int64,
+                                       (self.chunk_frames,))
+        self.chunk = (
+            frames,
+            self._open_memmap(labels_name, np.float32,
+                              (self.chunk_frames, LABEL_SIZE)),
+            self._open_memmap(timestamps_name, np.float64,
+                              (self.chunk_frames,)))
+        self.chunk_counts.append(0)
+
+    def _close_chunk(self):
+        if self.chunk is None:
+            return
+        for array in self.chunk:
+            array.flush()
+        self.chunk = None
+
+    def append(self, image, label, timestamp):
+        if self.chunk is None:
+            self._open_chunk()
+        frames, labels, timestamps = self.chunk
+        row = self.chunk_counts[-1]
+        if self.frames_file is None:
+            frames[row] = image
+        else:
+            extension, params = CODECS[self.codec]
+            _, encoded = cv2.imencode(extension, image, params)
+            self.frames_file.write(encoded.tobytes())
+            self.offset += encoded.size
+            frames[row] = self.offset
+        labels[row] = label
+        timestamps[row] = timestamp
+        self.chunk_counts[-1] += 1
+        if self.chunk_counts[-1] == self.chunk_frames:
+            self._close_chunk()
+
+    def _merge_chunks(self, chunk_name, filename, dtype, shape, start=()):
+        merged = self._open_memmap(filename, dtype,
+                                   (len(start) + len(self), *shape))
+        if len(start):
+            merged[:len(start)] = start
+        row = len(start)
+        for index, count in enumerate(self.chunk_counts):
+            path = os.path.join(self.path, chunk_name(index))
+            merged[row:row + count] = np.load(path, mmap_mode='r')[:count]
+            row += count
+            os.remove(path)
+        merged.flush()
+
+    def close(self):
+        self._close_chunk()
+        if self.frames_file is not None:
+            self.frames_file.close()
+            self._merge_chunks(lambda i: chunk_filenames(i)[3],
+                               INDEX_FILENAME, np.int64, (), start=[0])
+        self._merge_chunks(lambda i: chunk_filenames(i)[1],
+                           LABELS_FILENAME, np.float32, (LABEL_SIZE,))
+        self._merge_chunks(lambda i: chunk_filenames(i)[2],
+                           TIMESTAMPS_FILENAME, np.float64, ())
+        metadata = {'frames': len(self),
+                    'frame_shape': self.frame_shape,
+                    'codec': self.codec,
+                    'chunk_frames': self.chunk_frames,
+                    'chunk_counts': self.chunk_counts}
+        with open(os.path.join(self.path, METADATA_FILENAME), 'w') as f:
+            json.dump(metadata, f)
+
+    def abort(self):
+        self.chunk = None
+        if self.frames_file is not None:
+            self.frames_file.close()
+
+
+# Random access to a saved session without loading it. Labels and
+# timestamps are memory mapped columns, frame i is a memory mapped row or a
+# single decode at the offset given by the index.
+class SessionReader():
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, METADATA_FILENAME)) as f:
+            self.metadata = json.load(f)
+        self.frame_shape = tuple(self.metadata['frame_shape'])
+        self.codec = self.metadata['codec']
+        self.labels = self._load(LABELS_FILENAME)
+        self.timestamps = self._load(TIMESTAMPS_FILENAME)
+        if CODECS[self.codec] is None:
+            self.chunk_frames = self.metadata['chunk_frames']
+            self.chunks = [self._load(chunk_filenames(index)[0])
+                           for index in range(len(self.metadata['chunk_counts']))]
+        else:
+            self.index = self._load(INDEX_FILENAME)
+            frames_path = os.path.join(path, FRAMES_FILENAME)
+            if os.path.getsize(frames_path):
+                self.data = np.memmap(frames_path, dtype=np.uint8, mode='r')
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.path, filename), mmap_mode='r')
+
+    def __len__(self):
+        return self.metadata['frames']
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('Frame {} out of range'.format(i))
+        if CODECS[self.codec] is None:
+            return self.chunks[i // self.chunk_frames][i % self.chunk_frames]
+        encoded = self.data[self.index[i]:self.index[i + 1]]
+        return cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+
+    def frames(self, indices, out=None):
+        if out is None:
+            out = np.empty((len(indices), *self.frame_shape), dtype=np.uint8)
+        for row, i in enumerate(indices):
+            out[row] = self[i]
+        return out
+
+
+def find_sessions(directory):
+    pattern = os.path.join(directory, SESSION_PATTERN)
+    return sorted(path for path in glob.glob(pattern)
+                  if os.path.exists(os.path.join(path, METADATA_FILENAME)))
@@ -0,0 +1,115 @@
+import asyncio
+import collections
+import logging
+import time
+
+import cv2
+
+import metrics
+
+# When a subscriber's queue is full, either the oldest queued frame makes
+# room for the new one, or the new frame is dropped.
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DEBUG_FRAME_INTERVAL = 1.0  # seconds
+
+Frame = collections.namedtuple('Frame', ['sequence', 'timestamp', 'image'])
+
+
+# One consumer's view of the bus, a bounded queue of frames with its own
+# drop policy. A slow consumer only loses its own frames.
+class Subscription():
+    def __init__(self, bus, name, maxsize, policy):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('Unknown drop policy: {}'.format(policy))
+        self.bus = bus
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.frames = collections.deque()
+        self.waiter = None
+        self.dropped = metrics.counter('frame_bus.{}.dropped'.format(name))
+        self.frame_age = metrics.histogram('frame_bus.{}.frame_age'.format(name))
+
+    def publish(self, frame):
+        if len(self.frames) >= self.maxsize:
+            self.dropped.inc()
+            if self.policy == DROP_NEWEST:
+                return
+            self.frames.popleft()
+        self.frames.append(frame)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def get(self):
+        self.bus.start()
+        while not self.frames:
+            self.bus.request()
+            self.waiter = asyncio.get_running_loop().create_future()
+            await self.waiter
+        frame = self.frames.popleft()
+        self.frame_age.record(int((time.monotonic() - frame.timestamp) * 1e9))
+        return frame
+
+
+# Takes each captured and preprocessed camera frame once and hands it to
+# every subscriber. With on_demand a frame is only captured while some
+# subscriber waits for one, instead of continuously.
+class FrameBus():
+    def __init__(self, camera, on_demand=False):
+        self.camera = camera
+        self.on_demand = on_demand
+        self.subscriptions = []
+        self.task = None
+        self.demand = None
+        self.published = metrics.counter('frame_bus.published')
+
+    def subscribe(self, name, maxsize=1, policy=DROP_OLDEST):
+        subscription = Subscription(self, name, maxsize, policy)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.demand = asyncio.Event()
+            self.task = asyncio.ensure_future(self._publish())
+
+    def request(self):
+        if self.demand is not None:
+            self.demand.set()
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _publish(self):
+        sequence = 0
+        while True:
+            if self.on_demand:
+                await self.demand.wait()
+                self.demand.clear()
+            sequence, timestamp, image = await self.camera.get_frame(sequence)
+            frame = Frame(sequence, timestamp, image)
+            self.published.inc()
+            for subscription in self.subscriptions:
+                subscription.publish(frame)
+
+
+# Writes the newest frame to an image file now and then, to see what the
+# robot sees without disturbing the other consumers.
+class DebugSink():
+    def __init__(self, subscription, filename, interval=DEBUG_FRAME_INTERVAL):
+        self.subscription = subscription
+        self.filename = filename
+        self.interval = interval
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            frame = await self.subscription.get()
+            ok = await loop.run_in_executor(None, cv2.imwrite, self.filename,
+                                            frame.image)
+            if not ok:
+                logging.info('Could not write debug frame {}'.format(self.filename))
+            await asyncio.sleep(self.interval)
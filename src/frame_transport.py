@@ -0,0 +1,86 @@
+import logging
+import struct
+
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+
+SOCKET_PATH = '/tmp/mini_tank_inference.sock'
+RING_SLOTS = 4
+SHM_NAME_LENGTH = 32
+
+# Sent once per connection: shared memory name, frame height, width,
+# channels and number of slots in the ring.
+HELLO_FORMAT = '<{}s4I'.format(SHM_NAME_LENGTH)
+HELLO_SIZE = struct.calcsize(HELLO_FORMAT)
+HELLO_ACK = b'\x01'
+# Sent once per frame: index of the slot holding the frame.
+SLOT_FORMAT = '<I'
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+
+# Rings created by this process, they stay registered with its tracker.
+_created_rings = set()
+
+
+def encode_hello(name, shape, slots):
+    height, width, channels = shape
+    return struct.pack(HELLO_FORMAT, name.encode(), height, width, channels,
+                       slots)
+
+
+def decode_hello(payload):
+    name, height, width, channels, slots = struct.unpack(HELLO_FORMAT, payload)
+    return name.rstrip(b'\x00').decode(), (height, width, channels), slots
+
+
+def encode_slot(slot):
+    return struct.pack(SLOT_FORMAT, slot)
+
+
+def decode_slot(payload):
+    return struct.unpack(SLOT_FORMAT, payload)[0]
+
+
+# Ring of preallocated uint8 frame slots in shared memory. The agent creates
+# it and copies each frame in exactly once, the model server attaches to it
+# by name and reads the frames in place.
+class FrameRing():
+    def __init__(self, shape, slots=RING_SLOTS, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = name is None
+        size = slots * int(np.prod(self.shape))
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            _created_rings.add(self.shm.name)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator may unlink the segment, stop the tracker of
+            # the attaching process from doing it at exit.
+            if self.shm.name not in _created_rings:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.frames = np.ndarray((slots, *self.shape), dtype=np.uint8,
+                                 buffer=self.shm.buf)
+        self.next_slot = 0
+        message = 'Frame ring {} ready, shape={}, slots={}'
+        logging.info(message.format(self.name, self.shape, self.slots))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, image):
+        slot = self.next_slot
+        self.frames[slot] = image
+        self.next_slot = (slot + 1) % self.slots
+        return slot
+
+    def read(self, slot):
+        return self.frames[slot]
+
+    def close(self):
+        del self.frames
+        self.shm.close()
+        if self.owner:
+            _created_rings.discard(self.shm.name)
+            self.shm.unlink()
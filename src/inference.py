@@ -0,0 +1,395 @@
+import asyncio
+import ast
+import concurrent.futures
+import logging
+import struct
+import time
+
+from http import HTTPStatus
+import aiohttp
+import cv2
+import numpy as np
+
+import frame_transport
+import metrics
+import preprocessing
+
+INFERENCE_URL = "http://127.0.0.1"
+INFERENCE_PORT = 5000
+INFERENCE_SERVER = INFERENCE_URL + ':' + str(INFERENCE_PORT) + '/'
+# Answers 200 once the model server has loaded and warmed up its model.
+HEALTH_PATH = 'health'
+HEALTH_URL = INFERENCE_SERVER + HEALTH_PATH
+
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+# Prediction reply when the client accepts binary: base_speed, direction.
+PREDICTION_FORMAT = '<2f'
+KEEPALIVE_TIMEOUT = 30  # seconds
+REQUEST_TIMEOUT = 1.0  # seconds
+
+# Inference cache: frames are compared on a 1/CACHE_SIGNATURE_SCALE size
+# thumbnail, and a prediction is reused while the mean absolute difference
+# stays under CACHE_THRESHOLD grey levels, for at most CACHE_MAX_AGE.
+CACHE_SIGNATURE_SCALE = 20
+CACHE_THRESHOLD = 3.0
+CACHE_MAX_AGE = 0.3  # seconds
+
+MODEL_FILENAME = 'model.h5'
+TFLITE_THREADS = 4
+WARMUP_RUNS = 3
+
+
+def encode_prediction(base_speed, direction):
+    return struct.pack(PREDICTION_FORMAT, base_speed, direction)
+
+
+def decode_prediction(payload):
+    return struct.unpack(PREDICTION_FORMAT, payload)
+
+
+async def check_health(session, url=HEALTH_URL):
+    try:
+        async with session.get(url) as resp:
+            return resp.status == HTTPStatus.OK
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+
+# Long lived client for the model server. The session (and its pooled
+# keep-alive connection) is created on first use and reused for every frame
+# until close() is called.
+class HttpInference():
+    def __init__(self, url=INFERENCE_SERVER):
+        self.url = url
+        self.health_url = url + HEALTH_PATH
+        self.session = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=1, keepalive_timeout=KEEPALIVE_TIMEOUT)
+            timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=timeout)
+        return self.session
+
+    async def predict(self, raw_image):
+        headers = {'Content-Type': BINARY_CONTENT_TYPE,
+                   'Accept': BINARY_CONTENT_TYPE,
+                   'dtype': str(raw_image.dtype),
+                   'shape': str(raw_image.shape)}
+        image = raw_image.tobytes()
+        session = self._get_session()
+        try:
+            async with session.post(self.url, data=image,
+                                    headers=headers) as resp:
+                if resp.status != HTTPStatus.OK:
+                    logging.info('Bad response to HTTP POST request.')
+                    return False, None, None
+                if resp.content_type == BINARY_CONTENT_TYPE:
+                    payload = await resp.read()
+                    base_speed, direction = decode_prediction(payload)
+                else:
+                    # Older servers only reply with a stringified list.
+                    text = await resp.text()
+                    base_speed, direction = ast.literal_eval(text)[0]
+                return True, base_speed, direction
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            # Server down or slower than REQUEST_TIMEOUT, a failed frame.
+            logging.info('HTTP inference request failed: {!r}'.format(error))
+            return False, None, None
+
+    async def ready(self):
+        return await check_health(self._get_session(), self.health_url)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# The model call is traced once into a graph for a fixed input signature
+# (any batch size), so a frame costs one graph run instead of predict()'s
+# per call setup.
+class KerasPredictor():
+    def __init__(self, model_filename):
+        import tensorflow as tf
+        from tensorflow.keras.models import load_model
+        self.model = load_model(model_filename)
+        spec = self.model.inputs[0]
+        # A tf.DType in tf.keras 2, a plain string in Keras 3.
+        dtype = tf.as_dtype(spec.dtype)
+        self.dtype = dtype.as_numpy_dtype
+        signature = [tf.TensorSpec((None, *spec.shape[1:]), dtype)]
+        self.function = tf.function(self._call, input_signature=signature)
+
+    def _call(self, batch):
+        return self.model(batch, training=False)
+
+    def __call__(self, batch):
+        return self.function(np.asarray(batch, dtype=self.dtype)).numpy()
+
+
+class TFLitePredictor():
+    def __init__(self, model_filename, num_threads=TFLITE_THREADS):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=model_filename,
+                                       num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def _quantize(self, row):
+        dtype = self.input['dtype']
+        scale, zero_point = self.input['quantization']
+        if np.issubdtype(dtype, np.integer) and scale and \
+                (scale, zero_point) != (1.0, 0):
+            info = np.iinfo(dtype)
+            row = np.clip(np.round(row / scale + zero_point),
+                          info.min, info.max)
+        return row.astype(dtype, copy=False)
+
+    def _dequantize(self, row):
+        scale, zero_point = self.output['quantization']
+        if scale and np.issubdtype(self.output['dtype'], np.integer):
+            return (row.astype(np.float32) - zero_point) * scale
+        return row
+
+    def __call__(self, batch):
+        rows = []
+        for row in batch:
+            self.interpreter.set_tensor(self.input['index'],
+                                        self._quantize(row[np.newaxis]))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output['index'])[0]
+            rows.append(self._dequantize(output))
+        return np.array(rows)
+
+
+def load_predictor(model_filename):
+    logging.info('Loading model: {}'.format(model_filename))
+    if model_filename.endswith('.tflite'):
+        return TFLitePredictor(model_filename)
+    return KerasPredictor(model_filename)
+
+
+# A few predictions on blank frames, so graph building and memory
+# allocation are done before the first real frame.
+def warmup(predictor, shape=preprocessing.Preprocessor().output_shape,
+           runs=WARMUP_RUNS):
+    logging.info('Warming up model.')
+    frame = np.zeros((1, *shape), dtype=np.uint8)
+    for _ in range(runs):
+        predictor(frame)
+
+
+# Runs the model inside the agent process. Frames are handed to the model
+# as-is, no encoding or IPC. Prediction runs on a single worker thread so the
+# event loop keeps serving serial messages meanwhile.
+class LocalInference():
+    def __init__(self, model_filename=MODEL_FILENAME):
+        self.predictor = load_predictor(model_filename)
+        warmup(self.predictor)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _predict(self, raw_image):
+        return self.predictor(raw_image[np.newaxis])[0]
+
+    async def predict(self, raw_image):
+        loop = asyncio.get_running_loop()
+        prediction = await loop.run_in_executor(
+            self.executor, self._predict, raw_image)
+        base_speed, direction = prediction
+        return True, float(base_speed), float(direction)
+
+    async def ready(self):
+        return True
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+
+# Sends frames to model_server.py through a shared memory ring, only the
+# slot index travels over the unix socket. The frame shape is negotiated on
+# connection from the first frame and fixed afterwards.
+class SharedMemoryInference():
+    def __init__(self, socket_path=frame_transport.SOCKET_PATH,
+                 slots=frame_transport.RING_SLOTS, health_url=HEALTH_URL):
+        self.socket_path = socket_path
+        self.health_url = health_url
+        self.slots = slots
+        self.ring = None
+        self.reader = None
+        self.writer = None
+        self.lock = None
+
+    def _get_lock(self):
+        # Created lazily, the backend is built before the event loop runs.
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    async def _connect(self, shape):
+        self.ring = frame_transport.FrameRing(shape, slots=self.slots)
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.socket_path)
+        self.writer.write(frame_transport.encode_hello(
+            self.ring.name, shape, self.slots))
+        await self.writer.drain()
+        ack = await self.reader.readexactly(len(frame_transport.HELLO_ACK))
+        if ack != frame_transport.HELLO_ACK:
+            raise ConnectionError('Model server rejected frame ring.')
+        logging.info('Connected to model server at {}'.format(
+            self.socket_path))
+
+    async def _disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+    async def _request(self, raw_image):
+        if self.writer is None:
+            await self._connect(raw_image.shape)
+        elif raw_image.shape != self.ring.shape:
+            logging.info('Frame shape changed, bad frame.')
+            return None
+        slot = self.ring.write(raw_image)
+        self.writer.write(frame_transport.encode_slot(slot))
+        await self.writer.drain()
+        return await self.reader.readexactly(struct.calcsize(PREDICTION_FORMAT))
+
+    async def predict(self, raw_image):
+        async with self._get_lock():
+            try:
+                payload = await asyncio.wait_for(self._request(raw_image),
+                                                 REQUEST_TIMEOUT)
+            except (OSError, asyncio.IncompleteReadError,
+                    asyncio.TimeoutError) as error:
+                # A hung server times out like an HTTP request would.
+                logging.info('Model server connection lost: {!r}'.format(error))
+                await self._disconnect()
+                return False, None, None
+            except asyncio.CancelledError:
+                # Cancelled mid request (the autopilot flushing its
+                # pipeline), the reply still on its way would be read as
+                # the next frame's prediction. Start over on a new
+                # connection instead.
+                await self._disconnect()
+                raise
+        if payload is None:
+            return False, None, None
+        base_speed, direction = decode_prediction(payload)
+        return True, base_speed, direction
+
+    async def ready(self):
+        # The frame ring is served by the same model server, but only by its
+        # async server, the Flask one answers /health without it.
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            if not await check_health(session, self.health_url):
+                return False
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path), REQUEST_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            logging.info('No frame ring at {}'.format(self.socket_path))
+            return False
+        writer.close()
+        return True
+
+    async def close(self):
+        async with self._get_lock():
+            await self._disconnect()
+
+
+def frame_signature(image, scale=CACHE_SIGNATURE_SCALE):
+    height, width = image.shape[:2]
+    size = (max(1, width // scale), max(1, height // scale))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+# Wraps a backend and skips inference for frames that barely differ from
+# the one the last prediction was made for, as when standing still or on a
+# uniform straight. Hit rate and the inference time saved go to metrics.
+class InferenceCache():
+    def __init__(self, backend, threshold=CACHE_THRESHOLD,
+                 max_age=CACHE_MAX_AGE):
+        self.backend = backend
+        self.threshold = threshold
+        self.max_age = max_age
+        self.signature = None
+        self.prediction = None
+        self.prediction_time = None
+        self.inference_seconds = None
+        self.hits = metrics.counter('inference_cache.hits')
+        self.misses = metrics.counter('inference_cache.misses')
+        self.saved_ms = metrics.counter('inference_cache.saved_ms')
+        metrics.gauge('inference_cache.hit_rate', self.hit_rate)
+
+    def hit_rate(self):
+        total = self.hits.value + self.misses.value
+        return self.hits.value / total if total else 0.0
+
+    def _lookup(self, signature, now):
+        if self.signature is None or now - self.prediction_time > self.max_age:
+            return None
+        if signature.shape != self.signature.shape:
+            return None
+        difference = np.abs(signature - self.signature).mean()
+        if difference > self.threshold:
+            return None
+        return self.prediction
+
+    async def predict(self, raw_image):
+        signature = frame_signature(raw_image)
+        now = time.monotonic()
+        prediction = self._lookup(signature, now)
+        if prediction is not None:
+            self.hits.inc()
+            self.saved_ms.inc(self.inference_seconds * 1000.0)
+            return prediction
+        self.misses.inc()
+        start = time.perf_counter()
+        prediction = await self.backend.predict(raw_image)
+        elapsed = time.perf_counter() - start
+        # Running average of what a miss costs, credited on every hit.
+        if self.inference_seconds is None:
+            self.inference_seconds = elapsed
+        else:
+            self.inference_seconds += (elapsed - self.inference_seconds) * 0.1
+        if prediction[0]:
+            self.signature = signature
+            self.prediction = prediction
+            self.prediction_time = now
+        return prediction
+
+    async def ready(self):
+        return await self.backend.ready()
+
+    async def close(self):
+        await self.backend.close()
+
+
+BACKENDS = {
+    'http': HttpInference,
+    'local': LocalInference,
+    'shm': SharedMemoryInference,
+}
+
+
+def create_backend(name, cache=False, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError('Unknown inference backend: {}'.format(name))
+    logging.info('Using inference backend: {}'.format(name))
+    backend = BACKENDS[name](**kwargs)
+    if cache:
+        logging.info('Caching predictions for similar frames.')
+        backend = InferenceCache(backend)
+    return backend
@@ -0,0 +1,159 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+
+# Histogram bucket upper bounds in nanoseconds, 2^(1/8) (about 9%) apart
+# from 1 us to about 12 minutes.
+BUCKETS_PER_DOUBLING = 8
+BUCKET_BOUNDS = [int(1000 * 2 ** (i / BUCKETS_PER_DOUBLING))
+                 for i in range(30 * BUCKETS_PER_DOUBLING)]
+REPORT_FILENAME = 'metrics.json'
+REPORT_INTERVAL = 10  # seconds
+
+
+class Counter():
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _Timer():
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.record(time.perf_counter_ns() - self.start)
+
+
+# Fixed bucket latency histogram. Recording is a bisect and a few integer
+# updates, cheap enough for every frame and every serial message.
+# Percentiles are interpolated within their bucket.
+class LatencyHistogram():
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, nanoseconds):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if self.min is None or nanoseconds < self.min:
+            self.min = nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def time(self):
+        return _Timer(self)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        rank = self.count * percent / 100.0
+        seen = 0
+        lower = 0
+        for bound, count in zip(BUCKET_BOUNDS, self.buckets):
+            if count and seen + count >= rank:
+                # Samples are taken as spread evenly over the bucket,
+                # narrowed to the smallest and largest ones recorded.
+                low = max(lower, self.min)
+                high = min(bound, self.max)
+                fraction = (rank - seen) / count
+                return low + (high - low) * fraction
+            seen += count
+            lower = bound
+        return self.max
+
+    def snapshot(self):
+        to_ms = 1e-6
+        return {'count': self.count,
+                'mean_ms': self.total / self.count * to_ms if self.count else 0,
+                'p50_ms': self.percentile(50) * to_ms,
+                'p95_ms': self.percentile(95) * to_ms,
+                'p99_ms': self.percentile(99) * to_ms,
+                'max_ms': self.max * to_ms}
+
+
+class Metrics():
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def counter(self, name):
+        if name not in self.counters:
+            self.counters[name] = Counter()
+        return self.counters[name]
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram()
+        return self.histograms[name]
+
+    def timer(self, name):
+        return self.histogram(name).time()
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self):
+        return {'time': time.time(),
+                'counters': {name: counter.value
+                             for name, counter in self.counters.items()},
+                'histograms': {name: histogram.snapshot()
+                               for name, histogram in self.histograms.items()},
+                'gauges': {name: read() for name, read in self.gauges.items()}}
+
+    def write(self, filename=REPORT_FILENAME):
+        snapshot = self.snapshot()
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(snapshot, f, indent=1)
+        os.replace(tmp_filename, filename)
+
+    async def report_periodically(self, filename=REPORT_FILENAME,
+                                  interval=REPORT_INTERVAL):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(None, self.write, filename)
+            except OSError as error:
+                logging.info('Could not write metrics: {}'.format(error))
+
+
+# Process wide registry, used through the functions below.
+registry = Metrics()
+
+
+def counter(name):
+    return registry.counter(name)
+
+
+def histogram(name):
+    return registry.histogram(name)
+
+
+def timer(name):
+    return registry.timer(name)
+
+
+def gauge(name, read):
+    registry.gauge(name, read)
+
+
+def snapshot():
+    return registry.snapshot()
@@ -0,0 +1,186 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import inference
+
+MODEL_DIR = 'models'
+# Each version is a subdirectory holding one model file and metadata.json.
+# A version is only picked up once metadata.json exists, so write it last
+# (or copy the directory in under a temporary name and rename it).
+METADATA_FILENAME = 'metadata.json'
+MODEL_SUFFIXES = ('.tflite', '.h5')
+POLL_INTERVAL = 5.0  # seconds
+SHADOW_FRACTION = 0.1
+SHADOW_LOG = 'shadow.jsonl'
+
+ModelVersion = collections.namedtuple(
+    'ModelVersion', ['version', 'path', 'metadata', 'mtime'])
+LoadedModel = collections.namedtuple('LoadedModel', ['version', 'predictor'])
+
+
+def scan(directory):
+    versions = []
+    if not os.path.isdir(directory):
+        return versions
+    for name in os.listdir(directory):
+        version_dir = os.path.join(directory, name)
+        metadata_path = os.path.join(version_dir, METADATA_FILENAME)
+        if not os.path.isfile(metadata_path):
+            continue
+        models = sorted(filename for filename in os.listdir(version_dir)
+                        if filename.endswith(MODEL_SUFFIXES))
+        if not models:
+            continue
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+        except ValueError:
+            logging.info('Bad metadata for model {}'.format(name))
+            continue
+        versions.append(ModelVersion(name, os.path.join(version_dir, models[0]),
+                                     metadata, os.path.getmtime(metadata_path)))
+    versions.sort(key=lambda version: (version.mtime, version.version))
+    return versions
+
+
+# Versioned models in a directory. New versions are loaded and warmed up in
+# the background and then swapped in with a single assignment, so requests
+# never wait for a load and always see a complete model. A shadow version
+# can run on a sample of frames, off the request path, with its predictions
+# and latency logged next to the active model's.
+class ModelRegistry():
+    def __init__(self, directory=MODEL_DIR, load=inference.load_predictor,
+                 warmup=inference.warmup, shadow_fraction=SHADOW_FRACTION,
+                 shadow_log=SHADOW_LOG):
+        self.directory = directory
+        self.load = load
+        self.warmup = warmup
+        self.shadow_fraction = shadow_fraction
+        self.shadow_log = shadow_log
+        self.active = None
+        self.shadow = None
+        self.seen = set()
+        self.load_lock = threading.Lock()
+        self.shadow_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Held while a shadow evaluation runs, frames arriving meanwhile
+        # are not shadowed.
+        self.shadow_lock = threading.Lock()
+        self.rng = random.Random()
+        self.watcher = None
+        self.running = False
+
+    def versions(self):
+        return scan(self.directory)
+
+    def _find(self, version):
+        for model_version in self.versions():
+            if model_version.version == version:
+                return model_version
+        raise KeyError('Unknown model version: {}'.format(version))
+
+    def _load(self, version):
+        model_version = self._find(version)
+        logging.info('Loading model version {}'.format(version))
+        predictor = self.load(model_version.path)
+        self.warmup(predictor)
+        return LoadedModel(version, predictor)
+
+    def activate(self, version):
+        with self.load_lock:
+            loaded = self._load(version)
+            self.active = loaded
+        logging.info('Model version {} is active.'.format(version))
+
+    def set_shadow(self, version):
+        if version is None:
+            self.shadow = None
+            logging.info('Shadow evaluation stopped.')
+            return
+        with self.load_lock:
+            loaded = self._load(version)
+            self.shadow = loaded
+        logging.info('Shadowing model version {}.'.format(version))
+
+    def activate_latest(self):
+        versions = self.versions()
+        if not versions:
+            raise FileNotFoundError('No model versions in {}'.format(self.directory))
+        self.seen.update(version.version for version in versions)
+        self.activate(versions[-1].version)
+
+    def poll(self):
+        # Only versions that appeared since the last look are activated, a
+        # version picked by hand stays until a new one is added.
+        versions = self.versions()
+        new = [version for version in versions if version.version not in self.seen]
+        self.seen.update(version.version for version in versions)
+        if not new:
+            return
+        try:
+            self.activate(new[-1].version)
+        except Exception as error:
+            logging.info('Could not load model version {}: {}'.format(
+                new[-1].version, error))
+
+    def start(self, interval=POLL_INTERVAL):
+        self.running = True
+        self.watcher = threading.Thread(target=self._watch, args=(interval,),
+                                        daemon=True)
+        self.watcher.start()
+
+    def _watch(self, interval):
+        while self.running:
+            time.sleep(interval)
+            self.poll()
+
+    def predict(self, batch):
+        # Read once, a swap in the middle of this call is harmless.
+        active = self.active
+        start = time.perf_counter()
+        prediction = active.predictor(batch)
+        active_ms = (time.perf_counter() - start) * 1000.0
+        shadow = self.shadow
+        if shadow is not None and \
+                self.rng.random() < self.shadow_fraction and \
+                self.shadow_lock.acquire(blocking=False):
+            self.shadow_executor.submit(self._evaluate_shadow, shadow,
+                                        active.version, batch.copy(),
+                                        prediction, active_ms)
+        return prediction
+
+    def _evaluate_shadow(self, shadow, active_version, batch, prediction,
+                         active_ms):
+        try:
+            start = time.perf_counter()
+            shadow_prediction = shadow.predictor(batch)
+            shadow_ms = (time.perf_counter() - start) * 1000.0
+            record = {'time': time.time(),
+                      'active': active_version,
+                      'shadow': shadow.version,
+                      'active_prediction': prediction.tolist(),
+                      'shadow_prediction': shadow_prediction.tolist(),
+                      'active_ms': active_ms,
+                      'shadow_ms': shadow_ms}
+            with open(self.shadow_log, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except Exception as error:
+            logging.info('Shadow evaluation failed: {}'.format(error))
+        finally:
+            self.shadow_lock.release()
+
+    def status(self):
+        return {'active': self.active and self.active.version,
+                'shadow': self.shadow and self.shadow.version,
+                'versions': [{'version': version.version,
+                              'metadata': version.metadata}
+                             for version in self.versions()]}
+
+    def close(self):
+        self.running = False
+        self.shadow_executor.shutdown(wait=False)
@@ -1,32 +1,241 @@
 from flask import Flask
 from flask import request
+from flask import Response
+from flask import jsonify
+from aiohttp import web
+from http import HTTPStatus
+import argparse
+import asyncio
+import logging
+import os
+import threading
 import numpy as np
 import ast
-from tensorflow.keras.models import load_model
-from tensorflow.python.keras.backend import set_session
-import tensorflow as tf
+import batching
+import frame_transport
+import inference
+import model_registry
+import preprocessing
 MODEL_FILENAME='model.h5'
+HOST = '127.0.0.1'
 
 
 app = Flask(__name__)
 
-sess = tf.Session()
-graph = tf.get_default_graph()
-set_session(sess)
-model = load_model(MODEL_FILENAME)
+preprocess = preprocessing.Preprocessor()
+predictor = None
+registry = None
+# Set once the model is loaded and warmed up, /health answers 200 from then on.
+model_ready = threading.Event()
+# Flask serves each request on its own thread, and a TF Lite interpreter
+# must not run set_tensor/invoke/get_tensor for two callers at once.
+predict_lock = threading.Lock()
+
+def load(model_filename):
+    global predictor
+    # Keras models run as a compiled graph, exported .tflite artifacts
+    # (desktop_side/export.py) on the TF Lite interpreter.
+    loaded = inference.load_predictor(model_filename)
+    inference.warmup(loaded, preprocess.output_shape)
+    predictor = loaded
+    model_ready.set()
+    logging.info('Model ready.')
+
+def load_registry(directory, shadow=None):
+    global predictor, registry
+    # Serves the newest version in directory, and swaps in versions added
+    # later without a restart.
+    registry = model_registry.ModelRegistry(directory)
+    registry.activate_latest()
+    if shadow:
+        registry.set_shadow(shadow)
+    predictor = registry.predict
+    model_ready.set()
+    logging.info('Model ready.')
+    registry.start()
+
+def predict(np_arr):
+    with predict_lock:
+        return predictor(np_arr)
+
+# Model management requests, version changes load in the background.
+def models_status():
+    if registry is None:
+        return {'error': 'not serving from a model directory'}, HTTPStatus.NOT_FOUND
+    return registry.status(), HTTPStatus.OK
+
+def change_model(version, action):
+    if registry is None:
+        return {'error': 'not serving from a model directory'}, HTTPStatus.NOT_FOUND
+    if action == 'activate':
+        target = registry.activate
+    elif action == 'shadow':
+        target = registry.set_shadow
+        if version == 'none':
+            version = None
+    else:
+        return {'error': 'unknown action'}, HTTPStatus.NOT_FOUND
+    known = [model_version.version for model_version in registry.versions()]
+    if version is not None and version not in known:
+        return {'error': 'unknown version'}, HTTPStatus.NOT_FOUND
+    threading.Thread(target=target, args=(version,), daemon=True).start()
+    return {'loading': version, 'action': action}, HTTPStatus.ACCEPTED
+
+def decode_frame(headers, data):
+    dtype = headers.get('dtype')
+    shape = ast.literal_eval(headers.get('shape'))
+    frame = np.ndarray(shape=shape, dtype=dtype, buffer=data)
+    # Clients may send raw camera frames, bring them to the model input.
+    if frame.shape != preprocess.output_shape:
+        frame = preprocess(frame)
+    return frame
+
+@app.route('/' + inference.HEALTH_PATH, methods=['GET'])
+def health():
+    if not model_ready.is_set():
+        return 'loading', HTTPStatus.SERVICE_UNAVAILABLE
+    return 'ready'
+
+@app.route('/models', methods=['GET'])
+def models():
+    body, status = models_status()
+    return jsonify(body), status
+
+@app.route('/models/<version>/<action>', methods=['POST'])
+def models_change(version, action):
+    body, status = change_model(version, action)
+    return jsonify(body), status
 
 @app.route('/', methods=['POST'])
 def hello_world():
-    arr = request.data
-    dtype = request.headers.get('dtype')
-    shape_str = request.headers.get('shape')
-    shape = ast.literal_eval(shape_str)
-    shape = (1, *shape)
-    np_arr = np.ndarray(shape=shape, dtype=dtype, buffer=arr)#np.frombuffer(arr, dtype=np.uint8)
-    with graph.as_default():
-        set_session(sess)
-        np_response = model.predict(np_arr)
+    if not model_ready.is_set():
+        return 'loading', HTTPStatus.SERVICE_UNAVAILABLE
+    np_arr = decode_frame(request.headers, request.data)[np.newaxis]
+    np_response = predict(np_arr)
+    if inference.BINARY_CONTENT_TYPE in request.headers.get('Accept', ''):
+        base_speed, direction = np_response[0]
+        return Response(inference.encode_prediction(base_speed, direction),
+                        mimetype=inference.BINARY_CONTENT_TYPE)
     return str(np_response.tolist())
 
+# Async mode: every HTTP request and every frame ring slot goes through the
+# same MicroBatcher, so concurrent clients share batched predict calls.
+class AsyncModelServer():
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def handle_health(self, request):
+        if not model_ready.is_set():
+            return web.Response(text='loading',
+                                status=HTTPStatus.SERVICE_UNAVAILABLE)
+        return web.Response(text='ready')
+
+    async def handle_models(self, request):
+        body, status = models_status()
+        return web.json_response(body, status=status)
+
+    async def handle_models_change(self, request):
+        body, status = change_model(request.match_info['version'],
+                                    request.match_info['action'])
+        return web.json_response(body, status=status)
+
+    async def handle_http(self, request):
+        if not model_ready.is_set():
+            return web.Response(text='loading',
+                                status=HTTPStatus.SERVICE_UNAVAILABLE)
+        np_arr = decode_frame(request.headers, await request.read())
+        base_speed, direction = await self.batcher.predict(np_arr)
+        if inference.BINARY_CONTENT_TYPE in request.headers.get('Accept', ''):
+            return web.Response(
+                body=inference.encode_prediction(base_speed, direction),
+                content_type=inference.BINARY_CONTENT_TYPE)
+        return web.Response(text=str([[float(base_speed), float(direction)]]))
+
+    async def handle_frame_ring(self, reader, writer):
+        try:
+            hello = await reader.readexactly(frame_transport.HELLO_SIZE)
+        except asyncio.IncompleteReadError:
+            # A client checking the socket is there (see ready()).
+            writer.close()
+            return
+        if not model_ready.is_set():
+            # The client sees the connection drop and retries later.
+            writer.close()
+            return
+        name, shape, slots = frame_transport.decode_hello(hello)
+        ring = frame_transport.FrameRing(shape, slots=slots, name=name)
+        writer.write(frame_transport.HELLO_ACK)
+        try:
+            while True:
+                payload = await reader.readexactly(frame_transport.SLOT_SIZE)
+                slot = frame_transport.decode_slot(payload)
+                base_speed, direction = await self.batcher.predict(
+                    ring.read(slot))
+                writer.write(inference.encode_prediction(base_speed, direction))
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            ring.close()
+            writer.close()
+
+    async def serve(self, port, socket_path, load_model):
+        web_app = web.Application()
+        web_app.router.add_post('/', self.handle_http)
+        web_app.router.add_get('/' + inference.HEALTH_PATH, self.handle_health)
+        web_app.router.add_get('/models', self.handle_models)
+        web_app.router.add_post('/models/{version}/{action}',
+                                self.handle_models_change)
+        runner = web.AppRunner(web_app)
+        await runner.setup()
+        await web.TCPSite(runner, HOST, port).start()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(
+            self.handle_frame_ring, socket_path)
+        # Already listening, so clients see 'loading' rather than a refused
+        # connection while the model loads.
+        await asyncio.get_running_loop().run_in_executor(None, load_model)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await runner.cleanup()
+            await self.batcher.stop()
+
+async def serve_async(args):
+    batcher = batching.MicroBatcher(predict,
+                                    max_batch_size=args.max_batch_size,
+                                    max_wait=args.max_wait_ms / 1000.0)
+    await AsyncModelServer(batcher).serve(args.port, args.socket,
+                                          model_loader(args))
+
+def model_loader(args):
+    if args.model_dir:
+        return lambda: load_registry(args.model_dir, args.shadow)
+    return lambda: load(args.model)
+
 if __name__ == '__main__':
-    app.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=MODEL_FILENAME,
+                        help='model.h5 or an exported .tflite artifact')
+    parser.add_argument('--model-dir',
+                        help='serve the newest version in this directory and '
+                             'hot swap in new ones (see model_registry.py)')
+    parser.add_argument('--shadow',
+                        help='version in --model-dir to evaluate in the shadow '
+                             'of the active one')
+    parser.add_argument('--server', choices=('flask', 'async'),
+                        default='flask')
+    parser.add_argument('--port', type=int, default=inference.INFERENCE_PORT)
+    parser.add_argument('--socket', default=frame_transport.SOCKET_PATH)
+    parser.add_argument('--max-batch-size', type=int,
+                        default=batching.MAX_BATCH_SIZE)
+    parser.add_argument('--max-wait-ms', type=float,
+                        default=batching.MAX_WAIT * 1000.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.server == 'async':
+        asyncio.run(serve_async(args))
+    else:
+        threading.Thread(target=model_loader(args), daemon=True).start()
+        app.run(host=HOST, port=args.port)
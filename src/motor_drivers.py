@@ -0,0 +1,121 @@
+import logging
+
+import RPi.GPIO as GPIO
+
+PWM_FREQ = 70  # Hz
+# pigpio numbers pins the Broadcom way, the robot wiring uses board pins.
+BOARD_TO_BCM = {31: 6, 33: 13, 35: 19, 37: 26}
+
+
+# A driver hands out one channel per PWM pin. Channels take a duty cycle
+# from 0 to 100 and only touch the hardware when it changes.
+class RPiGPIOChannel():
+    def __init__(self, pin, frequency):
+        GPIO.setup(pin, GPIO.OUT)
+        self.pwm = GPIO.PWM(pin, frequency)
+        self.pwm.start(0)
+        self.duty_cycle = 0
+
+    def set_duty_cycle(self, duty_cycle):
+        if duty_cycle == self.duty_cycle:
+            return
+        self.pwm.ChangeDutyCycle(duty_cycle)
+        self.duty_cycle = duty_cycle
+
+    def close(self):
+        self.pwm.stop()
+        self.duty_cycle = 0
+
+
+# Software PWM timed by a thread per pin, jitters when the CPU is busy.
+class RPiGPIODriver():
+    def __init__(self, frequency=PWM_FREQ):
+        GPIO.setmode(GPIO.BOARD)
+        self.frequency = frequency
+
+    def channel(self, pin):
+        return RPiGPIOChannel(pin, self.frequency)
+
+    def cleanup(self):
+        GPIO.cleanup()
+
+
+class PigpioChannel():
+    def __init__(self, pi, pin, frequency):
+        self.pi = pi
+        self.pin = BOARD_TO_BCM[pin]
+        pi.set_PWM_frequency(self.pin, frequency)
+        pi.set_PWM_range(self.pin, 100)
+        pi.set_PWM_dutycycle(self.pin, 0)
+        self.duty_cycle = 0
+
+    def set_duty_cycle(self, duty_cycle):
+        duty_cycle = int(round(duty_cycle))
+        if duty_cycle == self.duty_cycle:
+            return
+        self.pi.set_PWM_dutycycle(self.pin, duty_cycle)
+        self.duty_cycle = duty_cycle
+
+    def close(self):
+        self.set_duty_cycle(0)
+
+
+# DMA timed PWM through the pigpiod daemon (sudo pigpiod), steady under
+# load and no CPU cost in this process.
+class PigpioDriver():
+    def __init__(self, frequency=PWM_FREQ):
+        import pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError('Could not connect to pigpiod.')
+        self.frequency = frequency
+
+    def channel(self, pin):
+        return PigpioChannel(self.pi, pin, self.frequency)
+
+    def cleanup(self):
+        self.pi.stop()
+
+
+class FakeChannel():
+    def __init__(self, pin):
+        self.pin = pin
+        self.duty_cycle = 0
+        self.updates = 0
+
+    def set_duty_cycle(self, duty_cycle):
+        if duty_cycle == self.duty_cycle:
+            return
+        self.duty_cycle = duty_cycle
+        self.updates += 1
+
+    def close(self):
+        self.duty_cycle = 0
+
+
+# Records duty cycles instead of driving pins, for tests and benchmarks.
+class FakeDriver():
+    def __init__(self, frequency=PWM_FREQ):
+        self.frequency = frequency
+        self.channels = {}
+
+    def channel(self, pin):
+        self.channels[pin] = FakeChannel(pin)
+        return self.channels[pin]
+
+    def cleanup(self):
+        pass
+
+
+DRIVERS = {
+    'rpi_gpio': RPiGPIODriver,
+    'pigpio': PigpioDriver,
+    'fake': FakeDriver,
+}
+
+
+def create_driver(name, **kwargs):
+    if name not in DRIVERS:
+        raise ValueError('Unknown motor driver: {}'.format(name))
+    logging.info('Using motor driver: {}'.format(name))
+    return DRIVERS[name](**kwargs)
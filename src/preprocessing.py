@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+# cv2 dsize, (width, height): frames come out as (320, 180, 3) arrays, the
+# input shape of the model built in desktop_side/train.py.
+MODEL_INPUT_SIZE = (180, 320)
+# (top, bottom, left, right) crop applied before resizing, None keeps the
+# whole frame.
+ROI = None
+# cv2.COLOR_* code applied after cropping, None keeps the camera's BGR.
+COLOR_CONVERSION = None
+# Same scaling as the Lambda layer at the input of the model.
+NORMALIZE_SCALE = 127.5
+NORMALIZE_OFFSET = 1.0
+
+
+# Turns camera frames into model input pixels. The agent, model_server.py
+# and train.py all go through this so the model sees the same pixels at
+# train and serve time.
+class Preprocessor():
+    def __init__(self, size=MODEL_INPUT_SIZE, roi=ROI,
+                 color_conversion=COLOR_CONVERSION):
+        self.size = tuple(size)
+        self.roi = roi
+        self.color_conversion = color_conversion
+        width, height = self.size
+        self.output_shape = (height, width, 3)
+
+    def crop(self, frame):
+        if self.roi is None:
+            return frame
+        top, bottom, left, right = self.roi
+        return frame[top:bottom, left:right]
+
+    def __call__(self, frame, out=None):
+        if out is None:
+            out = np.empty(self.output_shape, dtype=np.uint8)
+        image = self.crop(frame)
+        if self.color_conversion is not None:
+            image = cv2.cvtColor(image, self.color_conversion)
+        if image.shape == self.output_shape:
+            np.copyto(out, image, casting='unsafe')
+        else:
+            resized = cv2.resize(image, self.size, dst=out,
+                                 interpolation=cv2.INTER_AREA)
+            if resized is not out:
+                # cv2 reallocates when the dtypes differ.
+                np.copyto(out, resized, casting='unsafe')
+        return out
+
+    def batch(self, frames, out=None):
+        if out is None:
+            out = np.empty((len(frames), *self.output_shape), dtype=np.uint8)
+        if len(frames) and frames[0].shape == self.output_shape and \
+                self.roi is None and self.color_conversion is None:
+            np.copyto(out, frames, casting='unsafe')
+            return out
+        for frame, row in zip(frames, out):
+            self(frame, out=row)
+        return out
+
+
+def normalize(images, out=None):
+    if out is None:
+        out = np.empty(images.shape, dtype=np.float32)
+    np.multiply(images, 1.0 / NORMALIZE_SCALE, out=out, casting='unsafe')
+    np.subtract(out, NORMALIZE_OFFSET, out=out)
+    return out
@@ -0,0 +1,110 @@
+import datetime
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+import dataset
+import metrics
+import preprocessing
+
+RECORDING_DIR = '.'
+PENDING_DIR = 'session_pending'
+SESSION_PREFIX = 'session'
+RECORDING_CODEC = dataset.CODEC
+# Frames waiting for the writer thread, more are dropped rather than block
+# the event loop.
+WRITE_QUEUE = 16
+
+
+# Streams frames and labels to disk while driving, so RAM use stays flat
+# however long the drive is. Frames go to a pending session, save() commits
+# it as a timestamped session and delete() throws it away. Encoding and
+# file writes happen on a writer thread, append() only queues the frame.
+class Recorder():
+    def __init__(self, directory=RECORDING_DIR,
+                 frame_shape=preprocessing.Preprocessor().output_shape,
+                 codec=RECORDING_CODEC, chunk_frames=dataset.CHUNK_FRAMES,
+                 write_queue=WRITE_QUEUE):
+        self.directory = directory
+        self.frame_shape = tuple(frame_shape)
+        self.codec = codec
+        self.chunk_frames = chunk_frames
+        self.pending_path = os.path.join(directory, PENDING_DIR)
+        self.writer = None
+        self.frames = 0
+        self.queue = queue.Queue(maxsize=write_queue)
+        self.thread = None
+        self.dropped = metrics.counter('record.dropped_frames')
+        self.write_time = metrics.histogram('record.write')
+        if os.path.exists(self.pending_path):
+            logging.info('Discarding uncommitted recording.')
+            shutil.rmtree(self.pending_path)
+
+    def __len__(self):
+        return self.frames
+
+    def append(self, image, label, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if self.writer is None:
+            self.writer = dataset.SessionWriter(
+                self.pending_path, self.frame_shape, codec=self.codec,
+                chunk_frames=self.chunk_frames)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._write, daemon=True)
+            self.thread.start()
+        try:
+            self.queue.put_nowait((self.writer, image, label, timestamp))
+        except queue.Full:
+            self.dropped.inc()
+            return
+        self.frames += 1
+
+    def _write(self):
+        while True:
+            writer, image, label, timestamp = self.queue.get()
+            try:
+                with self.write_time.time():
+                    writer.append(image, label, timestamp)
+            except Exception as error:
+                logging.info('Could not record frame: {!r}'.format(error))
+            finally:
+                self.queue.task_done()
+
+    def _session_path(self):
+        now = datetime.datetime.now()
+        dt_string = now.strftime("_%Y_%m_%d_%H_%M_%S")
+        base = os.path.join(self.directory, SESSION_PREFIX + dt_string)
+        session_path = base
+        suffix = 1
+        # Two saves within the same second.
+        while os.path.exists(session_path):
+            suffix += 1
+            session_path = '{}_{}'.format(base, suffix)
+        return session_path
+
+    def save(self):
+        if not len(self):
+            logging.info('Nothing recorded, no session saved.')
+            return None
+        self.queue.join()
+        frames = len(self.writer)
+        self.writer.close()
+        self.writer = None
+        self.frames = 0
+        session_path = self._session_path()
+        os.rename(self.pending_path, session_path)
+        logging.info('Saved {} frames to {}'.format(frames, session_path))
+        return session_path
+
+    def delete(self):
+        self.queue.join()
+        self.frames = 0
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        if os.path.exists(self.pending_path):
+            shutil.rmtree(self.pending_path)
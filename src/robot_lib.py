@@ -1,56 +1,188 @@
 import asyncio
-import ast
+import bisect
+import collections
 import logging
+import threading
+import time
 
-from http import HTTPStatus
-import aiohttp
 import cv2
 
-import RPi.GPIO as GPIO
 import communications
+import frame_bus
+import inference
+import metrics
+import motor_drivers
+import preprocessing
+import recorder
 
 pin_left_a = 31
 pin_left_b = 33
 pin_right_a = 37
 pin_right_b = 35
-PWM_FREQ = 70  # Hz
 MIN_PWM = 12
 MAX_PWM = 100
+# 'rpi_gpio' (software PWM), 'pigpio' (DMA timed, needs pigpiod running) or
+# 'fake'.
+MOTOR_DRIVER = 'rpi_gpio'
+# Largest speed increase per second, in PWM percent, None for no limit.
+# Slowing down is never limited.
+MOTOR_SLEW_RATE = None
+# Longest interval credited to the slew limit, so the first command after a
+# pause still ramps up.
+MOTOR_SLEW_INTERVAL = 0.1  # seconds
 
 CAMERA_DEVICE = "/dev/video0"
-CAMERA_RESOLUTION = (180, 320)
+CAMERA_RESOLUTION = preprocessing.MODEL_INPUT_SIZE
+# Ask the driver for the smallest 4:3 mode covering the model width, same
+# aspect as the webcam default so the resize keeps the training geometry.
+# YUYV needs no decoding and one driver buffer means no stale frames.
+CAMERA_CAPTURE_RESOLUTION = (320, 240)
+CAMERA_FPS = 30
+CAMERA_FOURCC = 'YUYV'
+CAMERA_DRIVER_BUFFERS = 1
+# Capture on a background thread, keeping only the newest frames. False
+# reads on the event loop, only when a frame is asked for.
+CAMERA_THREADED = True
+CAMERA_FRAME_BUFFER = 2
+CAMERA_RETRY_DELAY = 0.005  # seconds
 
-INFERENCE_URL = "http://127.0.0.1"
-INFERENCE_PORT = 5000
-INFERENCE_SERVER = INFERENCE_URL + ':' + str(INFERENCE_PORT) + '/'
+# 'http' talks to model_server.py, 'shm' does too but passes frames through
+# shared memory, 'local' loads the model in this process.
+INFERENCE_BACKEND = 'http'
+# Reuse the last prediction for nearly identical frames, see
+# inference.InferenceCache.
+INFERENCE_CACHE = False
+# Drive commands remembered for labelling frames, a few seconds' worth.
+COMMAND_HISTORY = 256
+# Frames queued for the recorder, which samples the newest one each tick.
+RECORD_QUEUE = 1
+
+# Frames in flight in the autopilot: with 2 the next frame is captured while
+# the previous one is inferred, 1 runs capture and inference in turn.
+AUTOPILOT_PIPELINE_DEPTH = 2
+# Predictions for frames older than this are not acted on.
+AUTOPILOT_MAX_FRAME_AGE = 0.25  # seconds
 
 class Camera():
-    def __init__(self):
+    def __init__(self, threaded=CAMERA_THREADED):
         message = 'Initializing camera, camera_device={}, resolution={}'
         logging.info(message.format(CAMERA_DEVICE, CAMERA_RESOLUTION))
-        self.camera = cv2.VideoCapture(0)   # 0 -> index of camera
+        self.camera = cv2.VideoCapture(0, cv2.CAP_V4L2)   # 0 -> index of camera
+        self._configure()
+        self.preprocess = preprocessing.Preprocessor(CAMERA_RESOLUTION)
+        self.threaded = threaded
+        # Newest frames as (sequence, capture timestamp, image).
+        self.frames = collections.deque(maxlen=CAMERA_FRAME_BUFFER)
+        self.frame_lock = threading.Lock()
+        self.waiters = []
+        self.last_sequence = 0
+        self.thread = None
+        self.running = False
+        self.read_time = metrics.histogram('camera.read')
+        self.preprocess_time = metrics.histogram('camera.preprocess')
+        self.frame_age = metrics.histogram('camera.frame_age')
 
-    async def get_image(self):
+    def _configure(self):
+        width, height = CAMERA_CAPTURE_RESOLUTION
+        self.camera.set(cv2.CAP_PROP_FOURCC,
+                        cv2.VideoWriter_fourcc(*CAMERA_FOURCC))
+        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        self.camera.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
+        self.camera.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_DRIVER_BUFFERS)
+        message = 'Camera configured, width={}, height={}, fps={}'
+        logging.info(message.format(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH),
+                                    self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT),
+                                    self.camera.get(cv2.CAP_PROP_FPS)))
+
+    def start(self):
+        if self.thread is not None:
+            return
+        logging.info('Starting camera capture thread.')
+        self.running = True
+        self.thread = threading.Thread(target=self._capture, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        logging.info('Camera capture thread stopped.')
+
+    def _capture(self):
+        sequence = 0
+        while self.running:
+            with self.read_time.time():
+                done, frame = self.camera.read()
+            if not done:
+                time.sleep(CAMERA_RETRY_DELAY)
+                continue
+            timestamp = time.monotonic()
+            sequence += 1
+            with self.preprocess_time.time():
+                image = self.preprocess(frame)
+            entry = (sequence, timestamp, image)
+            with self.frame_lock:
+                self.frames.append(entry)
+                waiters, self.waiters = self.waiters, []
+            for loop, future in waiters:
+                try:
+                    loop.call_soon_threadsafe(self._wake, future, entry)
+                except RuntimeError:
+                    pass  # The waiting loop is already closed.
+
+    @staticmethod
+    def _wake(future, entry):
+        if not future.done():
+            future.set_result(entry)
+
+    async def get_frame(self, newer_than=0):
+        if not self.threaded:
+            return await self._read_frame(newer_than)
+        self.start()
+        with self.frame_lock:
+            if self.frames and self.frames[-1][0] > newer_than:
+                return self.frames[-1]
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.waiters.append((loop, future))
+        return await future
+
+    async def _read_frame(self, newer_than):
         done = False
         while not done:
-            done, frame = self.camera.read()
-            if done:
-                img = cv2.resize(frame, CAMERA_RESOLUTION, interpolation =cv2.INTER_AREA)
-                return img
-            else:
+            with self.read_time.time():
+                done, frame = self.camera.read()
+            if not done:
                 await asyncio.sleep(0)
+        timestamp = time.monotonic()
+        with self.preprocess_time.time():
+            image = self.preprocess(frame)
+        return newer_than + 1, timestamp, image
+
+    async def get_image(self):
+        sequence, timestamp, img = await self.get_frame(self.last_sequence)
+        self.last_sequence = sequence
+        age = time.monotonic() - timestamp
+        self.frame_age.record(int(age * 1e9))
+        return img
 
 class Motor():
-    def __init__(self, name, pin_a, pin_b):
+    def __init__(self, name, pin_a, pin_b, driver, slew_rate=MOTOR_SLEW_RATE):
         self.name = name
         message = 'Setting up motor({}) with pin_a={},pin_b={}'
         logging.info(message.format(self.name, pin_a, pin_b))
-        GPIO.setup((pin_a, pin_b), GPIO.OUT)
-        self.A = GPIO.PWM(pin_a, PWM_FREQ)
-        self.B = GPIO.PWM(pin_b, PWM_FREQ)
+        self.A = driver.channel(pin_a)
+        self.B = driver.channel(pin_b)
+        self.slew_rate = slew_rate
+        self.speed = 0
+        self.last_update = time.monotonic()
         self.stop()
 
     def drive(self, speed):
+        speed = self.limit_slew(speed)
         if speed > MIN_PWM:
             self.pwm(self.A, speed)
             self.pwm(self.B, 0)
@@ -61,6 +193,19 @@ class Motor():
             self.pwm(self.A, 0)
             self.pwm(self.B, 0)
 
+    def limit_slew(self, speed):
+        now = time.monotonic()
+        elapsed = min(now - self.last_update, MOTOR_SLEW_INTERVAL)
+        self.last_update = now
+        if self.slew_rate is not None:
+            # Reversing starts from standstill.
+            current = abs(self.speed) if self.speed * speed > 0 else 0
+            limit = current + self.slew_rate * elapsed
+            if abs(speed) > limit:
+                speed = limit if speed > 0 else -limit
+        self.speed = speed
+        return speed
+
     def pwm(self, channel, unsafe_pwm):
         if unsafe_pwm > MAX_PWM:
             safe_pwm = MAX_PWM
@@ -68,27 +213,73 @@ class Motor():
             safe_pwm = 0
         else:
             safe_pwm = unsafe_pwm
-        channel.start(safe_pwm)
+        channel.set_duty_cycle(safe_pwm)
 
     def stop(self):
-        self.A.stop()
-        self.B.stop()
+        self.speed = 0
+        self.A.set_duty_cycle(0)
+        self.B.set_duty_cycle(0)
+
+    def close(self):
+        self.A.close()
+        self.B.close()
 
     def __del__(self):
         self.stop()
 
+# Timestamped drive commands, so a frame can be labelled with the command
+# that was active when it was captured.
+class CommandHistory():
+    def __init__(self, maxlen=COMMAND_HISTORY):
+        self.times = collections.deque([float('-inf')], maxlen=maxlen)
+        self.commands = collections.deque([(0, 0)], maxlen=maxlen)
+
+    def record(self, command, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.times.append(timestamp)
+        self.commands.append(command)
+
+    def at(self, timestamp):
+        index = bisect.bisect_right(self.times, timestamp) - 1
+        return self.commands[max(index, 0)]
+
 class Robot():
-    def __init__(self):
+    def __init__(self, inference_backend=INFERENCE_BACKEND,
+                 pipeline_depth=AUTOPILOT_PIPELINE_DEPTH,
+                 max_frame_age=AUTOPILOT_MAX_FRAME_AGE,
+                 motor_driver=MOTOR_DRIVER):
         logging.info('Initializing robot')
-        GPIO.setmode(GPIO.BOARD)
-        self.left = Motor('left', pin_left_a, pin_left_b)
-        self.right = Motor('right', pin_right_a, pin_right_b)
+        self.motor_driver = motor_drivers.create_driver(motor_driver)
+        self.left = Motor('left', pin_left_a, pin_left_b, self.motor_driver)
+        self.right = Motor('right', pin_right_a, pin_right_b, self.motor_driver)
         self.camera = Camera()
+        # An unthreaded camera blocks the loop while it reads, so it only
+        # reads when a consumer is waiting.
+        self.frame_bus = frame_bus.FrameBus(
+            self.camera, on_demand=not self.camera.threaded)
+        self.record_frames = self.frame_bus.subscribe('record', RECORD_QUEUE)
+        self.autopilot_frames = self.frame_bus.subscribe('autopilot')
+        self.commands = CommandHistory()
         self.linear_speed = 0
         self.angular_velocity = 0
         self.autopilot_engaged = False
         self.com = None
-        self.data = Data()
+        self.data = recorder.Recorder()
+        self.inference = inference.create_backend(inference_backend,
+                                                  cache=INFERENCE_CACHE)
+        self.last_command_time = None
+        self.pipeline_depth = pipeline_depth
+        self.max_frame_age = max_frame_age
+        # Inferences in flight as (frame timestamp, task), oldest first.
+        self.pipeline = collections.deque()
+        self.capture_time = metrics.histogram('autopilot.capture')
+        self.inference_time = metrics.histogram('autopilot.inference')
+        self.motor_time = metrics.histogram('motor.update')
+        self.record_time = metrics.histogram('record.append')
+        self.failed_inferences = metrics.counter('autopilot.failed_inferences')
+        self.stale_predictions = metrics.counter('autopilot.stale_predictions')
+        metrics.gauge('command_age_s', self.command_age)
         logging.info('Robot initialized')
     
     def init_communications(self):
@@ -104,13 +295,21 @@ class Robot():
         self.right.stop()
         self.linear_speed = 0
         self.angular_velocity = 0
+        self.commands.record((0, 0))
         logging.info('Robot stopped.')
 
     def drive(self, linear_speed, angular_velocity):
-        self.linear_speed = linear_speed
-        self.angular_velocity = angular_velocity
-        self.right.drive(linear_speed + angular_velocity)
-        self.left.drive(linear_speed - angular_velocity)
+        with self.motor_time.time():
+            self.linear_speed = linear_speed
+            self.angular_velocity = angular_velocity
+            self.commands.record((linear_speed, angular_velocity))
+            self.right.drive(linear_speed + angular_velocity)
+            self.left.drive(linear_speed - angular_velocity)
+
+    def command_age(self):
+        if self.last_command_time is None:
+            return None
+        return time.monotonic() - self.last_command_time
     
     async def process_events(self):
         try:
@@ -121,16 +320,23 @@ class Robot():
             if self.autopilot_engaged:
                 logging.info('Disengaging autopilot.')
                 self.autopilot_engaged = False
-            await asyncio.sleep(1)
+                self.flush_pipeline()
             return
 
+        if message_dict:
+            self.last_command_time = time.monotonic()
         if 'engage' in message_dict:
-            logging.info('Engaging autopilot.')
-            self.autopilot_engaged = True
+            # The first autopilot frames should not pay for model loading.
+            if await self.inference.ready():
+                logging.info('Engaging autopilot.')
+                self.autopilot_engaged = True
+            else:
+                logging.info('Model not ready, not engaging autopilot.')
         if 'disengage' in message_dict:
             self.stop()
             logging.info('Disengaging autopilot.')
             self.autopilot_engaged = False
+            self.flush_pipeline()
         if 'save' in message_dict:
             self.stop()
             logging.info('Saving data.')
@@ -152,60 +358,66 @@ class Robot():
     
     async def autopilot(self):
         logging.info('Autopilot getting image...')
-        raw_image = await camera.get_image()
+        with self.capture_time.time():
+            frame = await self.autopilot_frames.get()
         logging.info('Autopilot got image.')
-        success, base_speed, direction = await post_request(raw_image)
-        if success:
-            base_speed *= 100.0
-            direction *= 60.0
-            log_message = 'Received message, base_speed={}, direction={}'
-            logging.info(log_message.format(base_speed, direction))
-            robot.drive(base_speed, direction)
-    
-    async def post_request(self, raw_image, url=INFERENCE_SERVER):
-        headers = {'Content-Type': 'application/octet-stream',
-                   'dtype': str(raw_image.dtype),
-                   'shape': str(raw_image.shape)}
-        image = raw_image.tobytes()
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=image, headers=headers) as resp:
-                if resp.status == HTTPStatus.OK:
-                    text = await resp.text()
-                    base_speed, direction = ast.literal_eval(text)[0]
-                    return True, base_speed, direction
-                else:
-                    logging.info('Bad response to HTTP POST request.')
-        return False, None, None
+        task = asyncio.ensure_future(self._timed_request(frame.image))
+        self.pipeline.append((frame.timestamp, task))
+        # Act on every finished prediction, waiting only when the pipeline
+        # is full.
+        while self.pipeline and (len(self.pipeline) >= self.pipeline_depth or
+                                 self.pipeline[0][1].done()):
+            timestamp, task = self.pipeline.popleft()
+            self._act_on_prediction(timestamp, *await task)
+
+    async def _timed_request(self, raw_image):
+        with self.inference_time.time():
+            return await self.post_request(raw_image)
+
+    def _act_on_prediction(self, timestamp, success, base_speed, direction):
+        if not success:
+            self.failed_inferences.inc()
+            return
+        if time.monotonic() - timestamp > self.max_frame_age:
+            self.stale_predictions.inc()
+            return
+        if not self.autopilot_engaged:
+            return
+        base_speed *= 100.0
+        direction *= 60.0
+        log_message = 'Received message, base_speed={}, direction={}'
+        logging.info(log_message.format(base_speed, direction))
+        self.drive(base_speed, direction)
+
+    def flush_pipeline(self):
+        while self.pipeline:
+            timestamp, task = self.pipeline.popleft()
+            task.cancel()
+
+    async def post_request(self, raw_image):
+        return await self.inference.predict(raw_image)
     
     async def collect_data(self):
         logging.info('Collecting data.')
-        image = await self.get_image()
-        arr = np.array(image)
-        x_train.append(arr)
-        y_train.append([robot.linear_speed/100.0, robot.angular_velocity/60.0])
-        
+        frame = await self.record_frames.get()
+        # Label with the command the tank was following at capture time.
+        linear_speed, angular_velocity = self.commands.at(frame.timestamp)
+        with self.record_time.time():
+            self.data.append(frame.image,
+                             [linear_speed/100.0, angular_velocity/60.0],
+                             frame.timestamp)
 
     def cleanup(self):
         self.stop()
-        logging.info('Clearing GPIO')
-        GPIO.cleanup()
+        self.camera.stop()
+        logging.info('Releasing motors')
+        self.left.close()
+        self.right.close()
+        self.motor_driver.cleanup()
         if self.com:
             self.com.cleanup()
 
-class Data():
-    def __init__(self):
-        self.x_train = []
-        self.y_train = []
-
-    def delete(self):
-        del self.x_train[:]
-        del self.y_train[:]
-    
-    def save(self):
-        now = datetime.datetime.now()
-        dt_string = now.strftime("_%Y_%m_%d_%H_%M_%S")
-        np_x_train = np.array(self.x_train)
-        np.save("x_train_set" + dt_string, np_x_train)
-        np_y_train = np.array(self.y_train)
-        np.save("y_train_set" + dt_string, np_y_train)
-        self.delete()
+    async def close(self):
+        self.flush_pipeline()
+        self.frame_bus.stop()
+        await self.inference.close()
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import metrics
+
+IDLE_INTERVAL = 0.05  # seconds between checks while disabled
+
+
+# Runs a step at up to `rate` Hz. Steps wait for a new camera frame, so a
+# tick starts on the first frame after its scheduled time. A step that
+# overruns its tick is counted and the ticks it missed are dropped rather
+# than run back to back to catch up. A step that raises is logged, counted
+# and handed to on_error, and the schedule carries on.
+class Scheduler():
+    def __init__(self, name, rate):
+        self.name = name
+        self.period = 1.0 / rate
+        self.next_tick = None
+        self.step_time = metrics.histogram(name + '.step')
+        self.lateness = metrics.histogram(name + '.lateness')
+        self.ticks = metrics.counter(name + '.ticks')
+        self.overruns = metrics.counter(name + '.overruns')
+        self.skipped_ticks = metrics.counter(name + '.skipped_ticks')
+        self.errors = metrics.counter(name + '.errors')
+
+    async def run(self, step, enabled=lambda: True, on_error=None):
+        logging.info('Scheduling {} at {:.1f} Hz'.format(self.name, 1.0 / self.period))
+        loop = asyncio.get_running_loop()
+        while True:
+            if not enabled():
+                self.next_tick = None
+                await asyncio.sleep(IDLE_INTERVAL)
+                continue
+            now = loop.time()
+            if self.next_tick is None:
+                self.next_tick = now
+            elif now < self.next_tick:
+                await asyncio.sleep(self.next_tick - now)
+            await self.tick(step, loop, on_error)
+
+    async def tick(self, step, loop, on_error=None):
+        start = loop.time()
+        self.lateness.record(int(max(0.0, start - self.next_tick) * 1e9))
+        deadline = self.next_tick + self.period
+        try:
+            await step()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.errors.inc()
+            logging.info('{} step failed'.format(self.name), exc_info=True)
+            if on_error is not None:
+                on_error()
+        end = loop.time()
+        self.ticks.inc()
+        self.step_time.record(int((end - start) * 1e9))
+        if end <= deadline:
+            self.next_tick = deadline
+            return
+        self.overruns.inc()
+        self.skipped_ticks.inc(int((end - deadline) / self.period))
+        self.next_tick = end
@@ -0,0 +1,95 @@
+import binascii
+import struct
+
+# Fixed size command frame sent by desktop_side/controller.py:
+# sync byte, sequence number, base speed and rotation axes quantized to
+# int16, flags and a CRC-16/CCITT of everything before it.
+SYNC = 0xA5
+FRAME_FORMAT = '<BBhhBH'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+PAYLOAD_SIZE = FRAME_SIZE - 2
+AXIS_SCALE = 32767
+CRC_INIT = 0xFFFF
+SYNC_BYTE = bytes([SYNC])
+
+FLAG_ENGAGE = 0x01
+FLAG_DISENGAGE = 0x02
+FLAG_SAVE = 0x04
+FLAG_ERASE = 0x08
+# Message keys of the JSON protocol for each flag.
+FLAG_NAMES = (
+    (FLAG_ENGAGE, 'engage'),
+    (FLAG_DISENGAGE, 'disengage'),
+    (FLAG_SAVE, 'save'),
+    (FLAG_ERASE, 'erase'),
+)
+
+
+def quantize_axis(value):
+    value = max(-1.0, min(1.0, value))
+    return int(round(value * AXIS_SCALE))
+
+
+def encode_command(sequence, a, b, flags=0):
+    payload = struct.pack(FRAME_FORMAT[:-1], SYNC, sequence & 0xFF,
+                          quantize_axis(a), quantize_axis(b), flags)
+    return payload + struct.pack('<H', binascii.crc_hqx(payload, CRC_INIT))
+
+
+def decode_command(frame):
+    _, sequence, a, b, flags, _ = struct.unpack(FRAME_FORMAT, frame)
+    message = {'a': a / AXIS_SCALE, 'b': b / AXIS_SCALE, 'seq': sequence}
+    for flag, name in FLAG_NAMES:
+        if flags & flag:
+            message[name] = 1
+    return message
+
+
+def valid_frame(frame):
+    crc, = struct.unpack_from('<H', frame, PAYLOAD_SIZE)
+    return binascii.crc_hqx(frame[:PAYLOAD_SIZE], CRC_INIT) == crc
+
+
+# Incremental parser for command frames. A sync byte only starts a frame if
+# the CRC matches, otherwise the search resumes on the next byte. Sequence
+# numbers reveal packets lost on the radio link.
+class BinaryParser():
+    def __init__(self):
+        self.buffer = bytearray()
+        self.last_sequence = None
+        self.crc_errors = 0
+        self.dropped = 0
+        self.discarded = 0
+
+    def feed(self, data):
+        buffer = self.buffer
+        buffer += data
+        messages = []
+        position = 0
+        while True:
+            start = buffer.find(SYNC_BYTE, position)
+            if start < 0:
+                self.discarded += len(buffer) - position
+                position = len(buffer)
+                break
+            self.discarded += start - position
+            position = start
+            if len(buffer) - start < FRAME_SIZE:
+                break
+            frame = bytes(buffer[start:start + FRAME_SIZE])
+            if not valid_frame(frame):
+                self.crc_errors += 1
+                self.discarded += 1
+                position = start + 1
+                continue
+            message = decode_command(frame)
+            self._track_sequence(message['seq'])
+            messages.append(message)
+            position = start + FRAME_SIZE
+        del buffer[:position]
+        return messages
+
+    def _track_sequence(self, sequence):
+        if self.last_sequence is not None:
+            self.dropped += (sequence - self.last_sequence - 1) % 256
+        self.last_sequence = sequence
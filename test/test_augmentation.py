@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'desktop_side'))
+import augmentation
+
+
+class TestAugmentation(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.X = rng.randint(0, 255, (6, 32, 18, 3)).astype(np.uint8)
+        self.y = rng.uniform(-1, 1, (6, 2)).astype(np.float32)
+
+    def test_flip_negates_direction(self):
+        X, y = augmentation.flip(self.X.copy(), self.y.copy(),
+                                 np.random.RandomState(0), 1.0)
+        np.testing.assert_array_equal(X, self.X[:, :, ::-1])
+        np.testing.assert_array_equal(y[:, 0], self.y[:, 0])
+        np.testing.assert_array_equal(y[:, 1], -self.y[:, 1])
+
+    def test_translate_corrects_direction(self):
+        X, y = augmentation.translate(self.X.copy(), self.y.copy(),
+                                      np.random.RandomState(0), 1.0, 3, 0.1)
+        shift = np.round((self.y[:, 1] - y[:, 1]) / 0.1).astype(int)
+        for frame, original, dx in zip(X, self.X, shift):
+            if dx > 0:
+                np.testing.assert_array_equal(frame[:, dx:], original[:, :-dx])
+            elif dx < 0:
+                np.testing.assert_array_equal(frame[:, :dx], original[:, -dx:])
+
+    def test_brightness_stays_in_range(self):
+        X = augmentation.brightness_and_shadow(
+            self.X.copy(), np.random.RandomState(0), (2.0, 2.0), 1.0, (0.5, 0.5))
+        self.assertEqual(X.dtype, np.uint8)
+        self.assertTrue((X >= np.minimum(self.X, 255 // 2)).all())
+
+    def test_reproducible_from_seed(self):
+        augmenter = augmentation.Augmenter()
+        first = augmenter(self.X.copy(), self.y.copy(), np.random.RandomState(7))
+        second = augmenter(self.X.copy(), self.y.copy(), np.random.RandomState(7))
+        np.testing.assert_array_equal(first[0], second[0])
+        np.testing.assert_array_equal(first[1], second[1])
+        self.assertEqual(first[0].shape, self.X.shape)
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+from unittest.mock import Mock
+
+import numpy as np
+
+import batching
+
+
+def predict(frames):
+    return np.stack([frames.reshape(len(frames), -1).mean(axis=1),
+                     np.full(len(frames), len(frames))], axis=1)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    async def run_frames(self, values, **kwargs):
+        batch_predict = Mock(side_effect=predict)
+        batcher = batching.MicroBatcher(batch_predict, **kwargs)
+        frames = [np.full((4, 4, 3), value, dtype=np.uint8)
+                  for value in values]
+        rows = await asyncio.gather(*[batcher.predict(frame)
+                                      for frame in frames])
+        await batcher.stop()
+        return batch_predict, rows
+
+    def test_each_caller_gets_its_row(self):
+        _, rows = asyncio.run(self.run_frames([1, 2, 3]))
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+
+    def test_concurrent_frames_are_batched(self):
+        batch_predict, rows = asyncio.run(
+            self.run_frames([1, 2, 3], max_wait=0.05))
+        self.assertEqual(batch_predict.call_count, 1)
+        self.assertEqual([row[1] for row in rows], [3, 3, 3])
+
+    def test_max_batch_size(self):
+        batch_predict, rows = asyncio.run(
+            self.run_frames(range(5), max_batch_size=2, max_wait=0.05))
+        self.assertEqual(batch_predict.call_count, 3)
+        self.assertEqual([row[1] for row in rows], [2, 2, 2, 2, 1])
+
+    def test_error_reaches_every_caller(self):
+        async def run():
+            batcher = batching.MicroBatcher(Mock(side_effect=RuntimeError))
+            with self.assertRaises(RuntimeError):
+                await batcher.predict(np.zeros((4, 4, 3)))
+            await batcher.stop()
+        asyncio.run(run())
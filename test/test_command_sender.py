@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'desktop_side'))
+import command_sender
+import wire_protocol
+
+
+class TestCommandSender(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.sender = command_sender.CommandSender(
+            self.sent.append, max_rate=50, heartbeat_interval=0.1)
+
+    def messages(self):
+        return [json.loads(message) for message in self.sent]
+
+    def test_deadband(self):
+        self.sender.set_axis(0, 0.03)
+        self.sender.set_axis(1, -0.2)
+        self.assertEqual(self.sender.axes, [0.0, -0.2])
+
+    def test_heartbeat_when_still(self):
+        self.assertTrue(self.sender.poll(0.0))
+        self.assertFalse(self.sender.poll(0.05))
+        self.assertTrue(self.sender.poll(0.1))
+        self.assertEqual(self.messages(), [{'a': 0.0, 'b': 0.0}] * 2)
+
+    def test_small_moves_wait_for_heartbeat(self):
+        self.sender.poll(0.0)
+        self.sender.set_axis(0, 0.5)
+        self.sender.poll(0.02)
+        self.sender.set_axis(0, 0.51)
+        self.assertFalse(self.sender.poll(0.04))
+        self.assertTrue(self.sender.poll(0.125))
+        self.assertEqual(self.messages()[-1], {'a': 0.51, 'b': 0.0})
+
+    def test_max_rate(self):
+        self.sender.poll(0.0)
+        self.sender.set_axis(0, 0.5)
+        # At most one command per 1/50 s however fast the stick moves.
+        self.assertFalse(self.sender.poll(0.01))
+        self.assertEqual(self.sender.next_send_time(), 0.02)
+        self.assertTrue(self.sender.poll(0.02))
+        self.assertEqual(self.messages()[-1], {'a': 0.5, 'b': 0.0})
+
+    def test_return_to_center_always_sent(self):
+        self.sender.set_axis(0, 0.06)
+        self.sender.poll(0.0)
+        self.sender.set_axis(0, 0.04)
+        self.assertTrue(self.sender.changed())
+        self.assertTrue(self.sender.poll(0.02))
+        self.assertEqual(self.messages()[-1], {'a': 0.0, 'b': 0.0})
+
+    def test_flags_sent_once(self):
+        self.sender.poll(0.0)
+        self.sender.press(wire_protocol.FLAG_ENGAGE)
+        self.assertTrue(self.sender.poll(0.02))
+        self.assertTrue(self.sender.poll(0.125))
+        self.assertEqual(self.messages()[1:],
+                         [{'a': 0.0, 'b': 0.0, 'engage': 1},
+                          {'a': 0.0, 'b': 0.0}])
+
+    def test_heartbeat_within_agent_timeout(self):
+        import communications
+        self.assertEqual(command_sender.AGENT_HEARTBEAT_TIMEOUT,
+                         communications.HEARTBEAT_TIMEOUT)
+        self.assertLessEqual(command_sender.HEARTBEAT_INTERVAL,
+                             command_sender.MAX_HEARTBEAT_INTERVAL)
+        with self.assertRaises(ValueError):
+            command_sender.CommandSender(self.sent.append,
+                                         heartbeat_interval=0.25)
+
+    def test_binary(self):
+        sender = command_sender.CommandSender(self.sent.append, 'binary')
+        sender.set_axis(1, -0.5)
+        sender.press(wire_protocol.FLAG_SAVE)
+        sender.poll(0.0)
+        sender.poll(1.0)
+        first, second = [wire_protocol.decode_command(frame)
+                         for frame in self.sent]
+        self.assertEqual((first['seq'], first.get('save')), (0, 1))
+        self.assertAlmostEqual(first['b'], -0.5, places=3)
+        self.assertEqual((second['seq'], second.get('save')), (1, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 import asyncio
 import os
 import pty
+import time
 import unittest
 
 import communications
+import wire_protocol
 
 class TestCommunications(unittest.TestCase):
     def setUp(self):
@@ -34,10 +36,69 @@ class TestCommunications(unittest.TestCase):
         message = asyncio.run(self.comm.get_message())
         self.assertEqual(message, {})
     
+    def test_latest_command_wins(self):
+        os.write(self.primary, b'{"a":1}{"a":2}')
+
+        async def get_message():
+            await asyncio.sleep(0.05)
+            return await self.comm.get_message()
+
+        self.assertEqual(asyncio.run(get_message()), {"a": 2})
+
+    def test_events_are_kept_in_order(self):
+        os.write(self.primary, b'{"a":1,"engage":1}{"a":2,"save":1}{"a":3}')
+
+        async def get_messages():
+            await asyncio.sleep(0.05)
+            return [await self.comm.get_message(),
+                    await self.comm.get_message()]
+
+        self.assertEqual(asyncio.run(get_messages()),
+                         [{"a": 3, "engage": 1}, {"save": 1}])
+
+    def test_recovers_after_timeout(self):
+        async def lose_and_recover():
+            with self.assertRaises(Exception):
+                await self.comm.get_message(timeout=0.05)
+            os.write(self.primary, b'{"a":1,"b":2}')
+            return await self.comm.get_message(timeout=0.5)
+
+        self.assertEqual(asyncio.run(lose_and_recover()), {"a": 1, "b": 2})
+
+    def test_bad_message_is_not_a_heartbeat(self):
+        async def get_messages():
+            os.write(self.primary, b'{"a":1}')
+            await self.comm.get_message()
+            heartbeat = self.comm.last_message_time
+            os.write(self.primary, b'{:1}')
+            self.assertEqual(await self.comm.get_message(), {})
+            return heartbeat
+
+        heartbeat = asyncio.run(get_messages())
+        self.assertEqual(self.comm.last_message_time, heartbeat)
+
     def test_timeout(self):
         with self.assertRaises(Exception):
             message = asyncio.run(self.comm.get_message())
 
+    def test_binary_message_received(self):
+        os.write(self.primary, wire_protocol.encode_command(
+            3, 0.5, -0.5, wire_protocol.FLAG_SAVE))
+        message = asyncio.run(self.comm.get_message())
+        self.assertEqual(message['seq'], 3)
+        self.assertEqual(message['save'], 1)
+        self.assertAlmostEqual(message['a'], 0.5, places=4)
+        self.assertEqual(self.comm.protocol, 'binary')
+
+    def test_protocol_detected_from_json(self):
+        os.write(self.primary, b'{"a":1,"b":2}')
+        asyncio.run(self.comm.get_message())
+        self.assertEqual(self.comm.protocol, 'json')
+
+    def test_unknown_protocol(self):
+        with self.assertRaises(ValueError):
+            communications.Communications(protocol='xml')
+
 class TestMessageParser(unittest.TestCase):
     def setUp(self):
         self.parser = communications.MessageParser()
@@ -96,3 +157,49 @@ class TestMessageParser(unittest.TestCase):
         self.assertEqual(message_dict['a'], 1.0)
         self.assertEqual(message_dict['b'], 2)
 
+
+
+class TestIncrementalParser(unittest.TestCase):
+    def setUp(self):
+        self.parser = communications.MessageParser()
+
+    def test_partial_message(self):
+        self.assertEqual(self.parser.feed(b'{"a":'), [])
+        self.assertEqual(self.parser.feed(b'1}'), [b'{"a":1}'])
+        self.assertEqual(self.parser.buffer, b'')
+
+    def test_every_message_in_one_read(self):
+        messages = self.parser.feed(b'{"a":1}{"a":2}{"a":3}{"a"')
+        self.assertEqual(messages, [b'{"a":1}', b'{"a":2}', b'{"a":3}'])
+        self.assertEqual(self.parser.buffer, b'{"a"')
+
+    def test_resync_on_garbage(self):
+        messages = self.parser.feed(b'\xff\x00}{"a":1}')
+        self.assertEqual(messages, [b'{"a":1}'])
+        self.assertEqual(self.parser.discarded, 3)
+
+    def test_resync_on_truncated_message(self):
+        messages = self.parser.feed(b'{"a":1,"b{"a":2}')
+        self.assertEqual(messages, [b'{"a":2}'])
+
+    def test_buffer_is_capped(self):
+        parser = communications.MessageParser(max_buffer=16)
+        parser.feed(b'{' + b'x' * 100)
+        self.assertEqual(len(parser.buffer), 0)
+        self.assertEqual(parser.feed(b'{"a":1}'), [b'{"a":1}'])
+
+    def test_bad_bytes_message(self):
+        message, = self.parser.feed(b'{\xff\xff:1,"b":2}')
+        self.assertEqual(self.parser.proccess_message(message), {})
+
+    def test_throughput(self):
+        message = b'{"a":-0.0039215087890625,"b":0.0039215087890625}'
+        stream = message * 20000
+        start = time.perf_counter()
+        count = 0
+        for i in range(0, len(stream), 64):
+            count += len(self.parser.feed(stream[i:i + 64]))
+        elapsed = time.perf_counter() - start
+        self.assertEqual(count, 20000)
+        # Far more than the ~250 messages/s a 115200 baud link can carry.
+        self.assertGreater(count / elapsed, 20000)
@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'desktop_side'))
+import data_pipeline
+import dataset
+
+
+class TestDataPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.frame_shape = (320, 180, 3)
+        self.write_session('session_a', 0, 30)
+        self.write_session('session_b', 30, 10)
+        # Older agents saved a plain npy pair.
+        values = np.arange(40, 45)
+        np.save(os.path.join(self.tmp_dir.name, 'x_train_set_old.npy'),
+                np.ones((5, *self.frame_shape), dtype=np.uint8)
+                * values[:, None, None, None].astype(np.uint8))
+        np.save(os.path.join(self.tmp_dir.name, 'y_train_set_old.npy'),
+                np.stack([values, values], axis=1).astype(np.float32))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_session(self, name, first, count):
+        path = os.path.join(self.tmp_dir.name, name)
+        writer = dataset.SessionWriter(path, self.frame_shape, codec='raw')
+        for value in range(first, first + count):
+            writer.append(np.full(self.frame_shape, value, dtype=np.uint8),
+                          [value, 0], float(value))
+        writer.close()
+
+    def test_discover_sessions(self):
+        sessions = data_pipeline.discover_sessions([self.tmp_dir.name])
+        self.assertEqual(sorted(len(session) for session in sessions),
+                         [5, 10, 30])
+
+    def test_split_by_session(self):
+        sessions = data_pipeline.discover_sessions([self.tmp_dir.name])
+        train, valid = data_pipeline.split_sessions(sessions, 0.2)
+        self.assertEqual(len(train) + len(valid), 3)
+        train_sessions = {id(segment.session) for segment in train}
+        valid_sessions = {id(segment.session) for segment in valid}
+        self.assertFalse(train_sessions & valid_sessions)
+
+    def test_split_single_session(self):
+        sessions = data_pipeline.discover_sessions([self.tmp_dir.name])[:1]
+        train, valid = data_pipeline.split_sessions(sessions, 0.1)
+        self.assertEqual(train[0].stop, valid[0].start)
+        self.assertEqual(valid[0].stop, len(sessions[0]))
+
+    def test_split_large_sessions(self):
+        # No session fits the validation budget whole.
+        sessions = [list(range(length)) for length in (1000, 900, 1100)]
+        train, valid = data_pipeline.split_sessions(sessions, 0.05)
+        self.assertEqual(len(train), 3)
+        self.assertEqual([(segment.start, segment.stop) for segment in valid],
+                         [(750, 900)])
+        self.assertIs(valid[0].session, sessions[1])
+        frames = sum(segment.stop - segment.start for segment in train + valid)
+        self.assertEqual(frames, 3000)
+
+    def test_split_too_small(self):
+        with self.assertRaises(ValueError):
+            data_pipeline.split_sessions([[0]], 0.05)
+
+    def test_epoch_covers_every_frame_once(self):
+        sessions = data_pipeline.discover_sessions([self.tmp_dir.name])
+        segments = [data_pipeline.Segment(session, 0, len(session))
+                    for session in sessions]
+        stream = data_pipeline.BatchStream(segments, batch_size=8,
+                                           shuffle_buffer=6, prefetch=2)
+        batches = list(stream.epoch())
+        stream.close()
+        self.assertEqual(len(batches), len(stream))
+        labels = np.concatenate([y[:, 0] for _, y in batches])
+        frames = np.concatenate([X[:, 0, 0, 0] for X, _ in batches])
+        self.assertEqual(sorted(labels), list(range(45)))
+        np.testing.assert_array_equal(frames, labels)
+        self.assertNotEqual(list(labels), sorted(labels))
+
+    def test_epochs_are_reproducible(self):
+        sessions = data_pipeline.discover_sessions([self.tmp_dir.name])
+        segments = [data_pipeline.Segment(session, 0, len(session))
+                    for session in sessions]
+        stream = data_pipeline.BatchStream(segments, batch_size=8, seed=3)
+        first = [y for _, y in stream.epoch(1)]
+        second = [y for _, y in stream.epoch(1)]
+        stream.close()
+        for a, b in zip(first, second):
+            np.testing.assert_array_equal(a, b)
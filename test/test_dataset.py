@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import dataset
+
+FRAME_SHAPE = (32, 18, 3)
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'session_test')
+        rng = np.random.RandomState(0)
+        self.frames = rng.randint(0, 255, (10, *FRAME_SHAPE)).astype(np.uint8)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, codec):
+        writer = dataset.SessionWriter(self.path, FRAME_SHAPE, codec=codec,
+                                       chunk_frames=4)
+        for i, frame in enumerate(self.frames):
+            writer.append(frame, [i, -i], float(i))
+        writer.close()
+        return dataset.SessionReader(self.path)
+
+    def test_raw(self):
+        session = self.write('raw')
+        self.assertEqual(len(session), 10)
+        np.testing.assert_array_equal(session[7], self.frames[7])
+        np.testing.assert_array_equal(session.frames(range(10)), self.frames)
+
+    def test_png_is_lossless(self):
+        session = self.write('png')
+        np.testing.assert_array_equal(session[9], self.frames[9])
+        np.testing.assert_array_equal(session[-1], self.frames[-1])
+        np.testing.assert_array_equal(session.frames([3, 0]),
+                                      self.frames[[3, 0]])
+
+    def test_jpeg(self):
+        session = self.write('jpeg')
+        self.assertEqual(session[4].shape, FRAME_SHAPE)
+
+    def test_columns(self):
+        session = self.write('png')
+        np.testing.assert_array_equal(session.labels[:, 0], np.arange(10))
+        np.testing.assert_array_equal(session.timestamps, np.arange(10))
+        self.assertEqual(len(session.index), 11)
+
+    def test_compressed_is_smaller(self):
+        self.frames[:] = 100
+        self.write('png')
+        frames_size = os.path.getsize(
+            os.path.join(self.path, dataset.FRAMES_FILENAME))
+        self.assertLess(frames_size, self.frames.nbytes / 10)
+
+    def test_out_of_range(self):
+        session = self.write('raw')
+        with self.assertRaises(IndexError):
+            session[10]
+
+    def test_find_sessions(self):
+        self.write('raw')
+        os.makedirs(os.path.join(self.tmp_dir.name, 'session_pending'))
+        self.assertEqual(dataset.find_sessions(self.tmp_dir.name), [self.path])
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            dataset.SessionWriter(self.path, FRAME_SHAPE, codec='gif')
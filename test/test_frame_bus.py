@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+
+import frame_bus
+
+
+class FakeCamera():
+    def __init__(self, frames):
+        self.frames = frames
+        self.calls = 0
+
+    async def get_frame(self, newer_than=0):
+        self.calls += 1
+        if newer_than >= self.frames:
+            await asyncio.sleep(10)
+        await asyncio.sleep(0)
+        sequence = newer_than + 1
+        return sequence, float(sequence), 'image {}'.format(sequence)
+
+
+class TestFrameBus(unittest.TestCase):
+    def setUp(self):
+        self.camera = FakeCamera(frames=5)
+        self.bus = frame_bus.FrameBus(self.camera)
+
+    def run_bus(self, consume):
+        async def run():
+            try:
+                return await consume()
+            finally:
+                self.bus.stop()
+
+        return asyncio.run(run())
+
+    def test_every_subscriber_gets_each_frame(self):
+        first = self.bus.subscribe('test_first', maxsize=5)
+        second = self.bus.subscribe('test_second', maxsize=5)
+
+        async def consume():
+            return [(await first.get()).sequence for _ in range(5)], \
+                [(await second.get()).sequence for _ in range(5)]
+
+        self.assertEqual(self.run_bus(consume), ([1, 2, 3, 4, 5], [1, 2, 3, 4, 5]))
+        # Captured once, not once per subscriber.
+        self.assertEqual(self.camera.calls, 6)
+
+    def test_drop_oldest(self):
+        latest = self.bus.subscribe('test_latest')
+
+        async def consume():
+            self.bus.start()
+            await asyncio.sleep(0.05)
+            return await latest.get()
+
+        frame = self.run_bus(consume)
+        self.assertEqual((frame.sequence, frame.timestamp, frame.image),
+                         (5, 5.0, 'image 5'))
+        self.assertEqual(latest.dropped.value, 4)
+
+    def test_on_demand(self):
+        bus = frame_bus.FrameBus(self.camera, on_demand=True)
+        subscription = bus.subscribe('test_on_demand', maxsize=5)
+
+        async def consume():
+            try:
+                frame = await subscription.get()
+                await asyncio.sleep(0.05)
+                return frame
+            finally:
+                bus.stop()
+
+        self.assertEqual(asyncio.run(consume()).sequence, 1)
+        # Nothing captured while nobody waited for a frame.
+        self.assertEqual(self.camera.calls, 1)
+
+    def test_drop_newest(self):
+        backlog = self.bus.subscribe('test_backlog', maxsize=2,
+                                     policy=frame_bus.DROP_NEWEST)
+
+        async def consume():
+            await asyncio.sleep(0.05)
+            return [(await backlog.get()).sequence for _ in range(2)]
+
+        self.assertEqual(self.run_bus(consume), [1, 2])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            self.bus.subscribe('test_unknown', policy='block')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import frame_transport
+import inference
+
+SHAPE = (32, 18, 3)
+
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = frame_transport.FrameRing(SHAPE, slots=2)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_write_wraps_around(self):
+        slots = [self.ring.write(np.full(SHAPE, i, dtype=np.uint8))
+                 for i in range(3)]
+        self.assertEqual(slots, [0, 1, 0])
+        self.assertTrue((self.ring.read(0) == 2).all())
+        self.assertTrue((self.ring.read(1) == 1).all())
+
+    def test_attach_by_name(self):
+        image = np.random.randint(0, 255, SHAPE, dtype=np.uint8)
+        slot = self.ring.write(image)
+        attached = frame_transport.FrameRing(SHAPE, slots=2,
+                                             name=self.ring.name)
+        np.testing.assert_array_equal(attached.read(slot), image)
+        attached.close()
+
+    def test_hello(self):
+        payload = frame_transport.encode_hello(self.ring.name, SHAPE, 2)
+        self.assertEqual(len(payload), frame_transport.HELLO_SIZE)
+        name, shape, slots = frame_transport.decode_hello(payload)
+        self.assertEqual(name, self.ring.name)
+        self.assertEqual(shape, SHAPE)
+        self.assertEqual(slots, 2)
+
+
+class TestSharedMemoryInference(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp_dir.name, 'inference.sock')
+        self.reply_delay = 0
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    async def handle(self, reader, writer):
+        hello = await reader.readexactly(frame_transport.HELLO_SIZE)
+        name, shape, slots = frame_transport.decode_hello(hello)
+        ring = frame_transport.FrameRing(shape, slots=slots, name=name)
+        writer.write(frame_transport.HELLO_ACK)
+        try:
+            while True:
+                payload = await reader.readexactly(frame_transport.SLOT_SIZE)
+                frame = ring.read(frame_transport.decode_slot(payload))
+                await asyncio.sleep(self.reply_delay)
+                writer.write(inference.encode_prediction(
+                    float(frame.mean()), 0.5))
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            ring.close()
+            writer.close()
+
+    async def run_predictions(self):
+        server = await asyncio.start_unix_server(self.handle, self.socket_path)
+        backend = inference.SharedMemoryInference(socket_path=self.socket_path)
+        results = []
+        for value in (1, 2, 3):
+            image = np.full(SHAPE, value, dtype=np.uint8)
+            results.append(await backend.predict(image))
+        await backend.close()
+        server.close()
+        await server.wait_closed()
+        return results
+
+    def test_predict(self):
+        results = asyncio.run(self.run_predictions())
+        self.assertEqual(results, [(True, 1.0, 0.5), (True, 2.0, 0.5),
+                                   (True, 3.0, 0.5)])
+
+    def test_cancelled_request(self):
+        async def run():
+            server = await asyncio.start_unix_server(self.handle,
+                                                     self.socket_path)
+            backend = inference.SharedMemoryInference(
+                socket_path=self.socket_path)
+            results = [await backend.predict(np.full(SHAPE, 1, np.uint8))]
+            self.reply_delay = 0.05
+            task = asyncio.ensure_future(
+                backend.predict(np.full(SHAPE, 2, np.uint8)))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.reply_delay = 0
+            # Not the reply meant for the cancelled frame.
+            for value in (3, 4):
+                results.append(await backend.predict(
+                    np.full(SHAPE, value, np.uint8)))
+            await backend.close()
+            server.close()
+            await server.wait_closed()
+            return results
+
+        self.assertEqual(asyncio.run(run()), [(True, 1.0, 0.5), (True, 3.0, 0.5),
+                                              (True, 4.0, 0.5)])
+
+    def test_hung_server_times_out(self):
+        async def run():
+            server = await asyncio.start_unix_server(self.handle,
+                                                     self.socket_path)
+            backend = inference.SharedMemoryInference(
+                socket_path=self.socket_path)
+            self.reply_delay = 0.2
+            results = [await backend.predict(np.full(SHAPE, 1, np.uint8))]
+            self.reply_delay = 0
+            results.append(await backend.predict(np.full(SHAPE, 2, np.uint8)))
+            await backend.close()
+            server.close()
+            await server.wait_closed()
+            return results
+
+        with patch('inference.REQUEST_TIMEOUT', 0.05):
+            results = asyncio.run(run())
+        self.assertEqual(results, [(False, None, None), (True, 2.0, 0.5)])
+
+    def test_no_server(self):
+        backend = inference.SharedMemoryInference(socket_path=self.socket_path)
+        image = np.zeros(SHAPE, dtype=np.uint8)
+        success, _, _ = asyncio.run(backend.predict(image))
+        self.assertFalse(success)
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+import inference
+
+
+class TestPredictionFormat(unittest.TestCase):
+    def test_round_trip(self):
+        payload = inference.encode_prediction(0.5, -0.25)
+        self.assertEqual(len(payload), 8)
+        self.assertEqual(inference.decode_prediction(payload), (0.5, -0.25))
+
+
+class TestLocalInference(unittest.TestCase):
+    @patch('inference.load_predictor')
+    def setUp(self, load_predictor):
+        self.predictor = Mock(return_value=np.array([[0.5, -0.25]]))
+        load_predictor.return_value = self.predictor
+        self.backend = inference.LocalInference('model.h5')
+
+    def tearDown(self):
+        asyncio.run(self.backend.close())
+
+    def test_predict(self):
+        image = np.zeros((320, 180, 3), dtype=np.uint8)
+        success, base_speed, direction = asyncio.run(
+            self.backend.predict(image))
+        self.assertTrue(success)
+        self.assertEqual(base_speed, 0.5)
+        self.assertEqual(direction, -0.25)
+        batch = self.predictor.call_args[0][0]
+        self.assertEqual(batch.shape, (1, 320, 180, 3))
+
+    def test_warmed_up(self):
+        self.assertEqual(self.predictor.call_count, inference.WARMUP_RUNS)
+        self.assertTrue(asyncio.run(self.backend.ready()))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            inference.create_backend('carrier_pigeon')
+
+
+class TestInferenceCache(unittest.TestCase):
+    def setUp(self):
+        self.backend = Mock()
+        self.backend.predict = Mock(side_effect=self.backend_predict)
+        self.result = (True, 0.5, -0.25)
+        self.cache = inference.InferenceCache(self.backend, threshold=3.0,
+                                              max_age=0.3)
+        self.frame = np.full((320, 180, 3), 100, dtype=np.uint8)
+
+    async def backend_predict(self, raw_image):
+        return self.result
+
+    def predict(self, frame):
+        return asyncio.run(self.cache.predict(frame))
+
+    def test_similar_frame_hits(self):
+        self.assertEqual(self.predict(self.frame), (True, 0.5, -0.25))
+        noisy = self.frame.copy()
+        noisy[::7, ::7] += 10
+        self.assertEqual(self.predict(noisy), (True, 0.5, -0.25))
+        self.assertEqual(self.backend.predict.call_count, 1)
+        self.assertGreater(self.cache.hit_rate(), 0)
+
+    def test_different_frame_misses(self):
+        self.predict(self.frame)
+        self.predict(self.frame + 20)
+        self.assertEqual(self.backend.predict.call_count, 2)
+
+    def test_max_age(self):
+        self.predict(self.frame)
+        self.cache.prediction_time -= 1.0
+        self.predict(self.frame)
+        self.assertEqual(self.backend.predict.call_count, 2)
+
+    def test_failures_not_cached(self):
+        self.result = (False, None, None)
+        self.predict(self.frame)
+        self.predict(self.frame)
+        self.assertEqual(self.backend.predict.call_count, 2)
+
+
+class TestHealth(unittest.TestCase):
+    def check(self, status, make_backend=None):
+        from aiohttp import web
+
+        async def health(request):
+            return web.Response(status=status)
+
+        async def run():
+            web_app = web.Application()
+            web_app.router.add_get('/' + inference.HEALTH_PATH, health)
+            runner = web.AppRunner(web_app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            url = 'http://127.0.0.1:{}/'.format(port)
+            if make_backend is None:
+                backend = inference.HttpInference(url)
+            else:
+                backend = make_backend(url + inference.HEALTH_PATH)
+            try:
+                return await backend.ready()
+            finally:
+                await backend.close()
+                await runner.cleanup()
+
+        return asyncio.run(run())
+
+    def test_shared_memory_needs_socket(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'inference.sock')
+            make_backend = lambda health_url: inference.SharedMemoryInference(
+                socket_path=socket_path, health_url=health_url)
+            # Healthy, but a Flask server has no frame ring.
+            self.assertFalse(self.check(200, make_backend))
+
+            async def with_socket():
+                server = await asyncio.start_unix_server(
+                    lambda reader, writer: writer.close(), socket_path)
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        None, self.check, 200, make_backend)
+                finally:
+                    server.close()
+
+            self.assertTrue(asyncio.run(with_socket()))
+
+    def test_ready(self):
+        self.assertTrue(self.check(200))
+
+    def test_loading(self):
+        self.assertFalse(self.check(503))
+
+    def test_predict_server_down(self):
+        backend = inference.HttpInference('http://127.0.0.1:1/')
+
+        async def run():
+            try:
+                return await backend.predict(np.zeros((4, 4, 3), np.uint8))
+            finally:
+                await backend.close()
+
+        self.assertEqual(asyncio.run(run()), (False, None, None))
+
+    def test_server_down(self):
+        backend = inference.SharedMemoryInference(
+            health_url='http://127.0.0.1:1/' + inference.HEALTH_PATH)
+        self.assertFalse(asyncio.run(backend.ready()))
+
+
+class TestTFLitePredictor(unittest.TestCase):
+    def setUp(self):
+        self.interpreter = Mock()
+        self.interpreter.get_input_details.return_value = [
+            {'index': 0, 'dtype': np.int8, 'quantization': (0.5, -10)}]
+        self.interpreter.get_output_details.return_value = [
+            {'index': 1, 'dtype': np.int8, 'quantization': (0.25, 2)}]
+        self.interpreter.get_tensor.return_value = np.array([[6, -2]],
+                                                            dtype=np.int8)
+        interpreter_module = Mock()
+        interpreter_module.Interpreter.return_value = self.interpreter
+        modules = {'tflite_runtime': Mock(),
+                   'tflite_runtime.interpreter': interpreter_module}
+        with patch.dict('sys.modules', modules):
+            self.predictor = inference.TFLitePredictor('model.tflite')
+
+    def test_quantized_round_trip(self):
+        batch = np.array([[0, 10, 255]], dtype=np.uint8)
+        prediction = self.predictor(batch)
+        quantized = self.interpreter.set_tensor.call_args[0][1]
+        np.testing.assert_array_equal(quantized, [[-10, 10, 127]])
+        self.assertEqual(quantized.dtype, np.int8)
+        np.testing.assert_allclose(prediction, [[1.0, -1.0]])
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import metrics
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def setUp(self):
+        self.histogram = metrics.LatencyHistogram()
+
+    def test_empty(self):
+        self.assertEqual(self.histogram.snapshot()['count'], 0)
+        self.assertEqual(self.histogram.percentile(50), 0)
+
+    def test_percentiles(self):
+        for _ in range(90):
+            self.histogram.record(1000000)  # 1 ms
+        for _ in range(10):
+            self.histogram.record(100000000)  # 100 ms
+        snapshot = self.histogram.snapshot()
+        self.assertEqual(snapshot['count'], 100)
+        # Within one bucket, 2^(1/8) apart.
+        self.assertLess(abs(snapshot['p50_ms'] - 1), 0.09)
+        self.assertLess(abs(snapshot['p99_ms'] - 100), 9)
+        self.assertEqual(snapshot['max_ms'], 100)
+        self.assertAlmostEqual(snapshot['mean_ms'], 10.9)
+
+    def test_percentiles_within_bucket(self):
+        # 33 to 34 ms, as a 30 fps camera read.
+        for i in range(1000):
+            self.histogram.record(33000000 + i * 1000)
+        snapshot = self.histogram.snapshot()
+        self.assertLess(abs(snapshot['p50_ms'] - 33.5), 0.1)
+        self.assertLess(abs(snapshot['p95_ms'] - 33.95), 0.1)
+        self.assertLess(abs(snapshot['p99_ms'] - 33.99), 0.1)
+        self.assertLessEqual(snapshot['p99_ms'], snapshot['max_ms'])
+
+    def test_timer(self):
+        with self.histogram.time():
+            time.sleep(0.01)
+        self.assertEqual(self.histogram.count, 1)
+        self.assertGreaterEqual(self.histogram.max, 10000000)
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def test_snapshot(self):
+        self.metrics.counter('frames').inc()
+        self.metrics.counter('frames').inc(2)
+        with self.metrics.timer('capture'):
+            pass
+        self.metrics.gauge('age', lambda: 1.5)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'frames': 3})
+        self.assertEqual(snapshot['histograms']['capture']['count'], 1)
+        self.assertEqual(snapshot['gauges'], {'age': 1.5})
+
+    def test_write(self):
+        self.metrics.counter('frames').inc()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'metrics.json')
+            self.metrics.write(filename)
+            with open(filename) as f:
+                self.assertEqual(json.load(f)['counters'], {'frames': 1})
@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import model_registry
+
+
+class FakePredictor():
+    def __init__(self, path):
+        with open(path) as f:
+            self.value = float(f.read())
+        self.calls = 0
+
+    def __call__(self, batch):
+        self.calls += 1
+        return np.full((len(batch), 2), self.value)
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, 'models')
+        self.shadow_log = os.path.join(self.tmp_dir.name, 'shadow.jsonl')
+        self.registry = model_registry.ModelRegistry(
+            self.directory, load=FakePredictor, warmup=lambda predictor: None,
+            shadow_fraction=1.0, shadow_log=self.shadow_log)
+
+    def tearDown(self):
+        self.registry.close()
+        self.tmp_dir.cleanup()
+
+    def add_version(self, version, value, metadata=True, mtime=None):
+        version_dir = os.path.join(self.directory, version)
+        os.makedirs(version_dir)
+        with open(os.path.join(version_dir, 'model.tflite'), 'w') as f:
+            f.write(str(value))
+        if metadata:
+            metadata_path = os.path.join(version_dir,
+                                         model_registry.METADATA_FILENAME)
+            with open(metadata_path, 'w') as f:
+                json.dump({'value': value}, f)
+            if mtime is not None:
+                os.utime(metadata_path, (mtime, mtime))
+
+    def predict(self):
+        return self.registry.predict(np.zeros((1, 4, 4, 3)))[0, 0]
+
+    def test_scan(self):
+        now = time.time()
+        self.add_version('v2', 2, mtime=now)
+        self.add_version('v1', 1, mtime=now - 10)
+        self.add_version('incomplete', 3, metadata=False)
+        versions = model_registry.scan(self.directory)
+        self.assertEqual([version.version for version in versions], ['v1', 'v2'])
+        self.assertEqual(versions[0].metadata, {'value': 1})
+
+    def test_activate_latest(self):
+        now = time.time()
+        self.add_version('v1', 1, mtime=now - 10)
+        self.add_version('v2', 2, mtime=now)
+        self.registry.activate_latest()
+        self.assertEqual(self.predict(), 2)
+
+    def test_new_version_swapped_in(self):
+        self.add_version('v1', 1, mtime=time.time() - 10)
+        self.registry.activate_latest()
+        self.registry.poll()
+        self.assertEqual(self.predict(), 1)
+        self.add_version('v2', 2)
+        self.registry.poll()
+        self.assertEqual(self.registry.active.version, 'v2')
+        self.assertEqual(self.predict(), 2)
+
+    def test_manual_version_kept(self):
+        self.add_version('v1', 1, mtime=time.time() - 10)
+        self.add_version('v2', 2)
+        self.registry.activate_latest()
+        self.registry.activate('v1')
+        self.registry.poll()
+        self.assertEqual(self.predict(), 1)
+
+    def test_failed_load_keeps_active(self):
+        self.add_version('v1', 1, mtime=time.time() - 10)
+        self.registry.activate_latest()
+        self.add_version('broken', 'not a number')
+        self.registry.poll()
+        self.assertEqual(self.registry.active.version, 'v1')
+
+    def test_shadow(self):
+        self.add_version('v1', 1, mtime=time.time() - 10)
+        self.add_version('v2', 2)
+        self.registry.activate('v1')
+        self.registry.set_shadow('v2')
+        self.assertEqual(self.predict(), 1)
+        self.registry.shadow_executor.shutdown(wait=True)
+        with open(self.shadow_log) as f:
+            record = json.loads(f.readline())
+        self.assertEqual((record['active'], record['shadow']), ('v1', 'v2'))
+        self.assertEqual(record['active_prediction'], [[1.0, 1.0]])
+        self.assertEqual(record['shadow_prediction'], [[2.0, 2.0]])
+        self.assertIn('shadow_ms', record)
+
+    def test_unknown_version(self):
+        with self.assertRaises(KeyError):
+            self.registry.activate('v9')
+
+
+if __name__ == '__main__':
+    unittest.main()
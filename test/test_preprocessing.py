@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+import preprocessing
+
+
+class TestPreprocessor(unittest.TestCase):
+    def setUp(self):
+        self.preprocess = preprocessing.Preprocessor()
+
+    def test_output_shape_matches_model(self):
+        self.assertEqual(self.preprocess.output_shape, (320, 180, 3))
+
+    def test_resize(self):
+        frame = np.full((240, 320, 3), 7, dtype=np.uint8)
+        image = self.preprocess(frame)
+        self.assertEqual(image.shape, self.preprocess.output_shape)
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertTrue((image == 7).all())
+
+    def test_preallocated_output(self):
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        out = np.empty(self.preprocess.output_shape, dtype=np.uint8)
+        self.assertIs(self.preprocess(frame, out=out), out)
+
+    def test_roi(self):
+        preprocess = preprocessing.Preprocessor(size=(2, 2), roi=(0, 2, 2, 4))
+        frame = np.zeros((4, 4, 3), dtype=np.uint8)
+        frame[0:2, 2:4] = 9
+        self.assertTrue((preprocess(frame) == 9).all())
+
+    def test_batch(self):
+        frames = np.zeros((3, 240, 320, 3), dtype=np.uint8)
+        batch = self.preprocess.batch(frames)
+        self.assertEqual(batch.shape, (3, *self.preprocess.output_shape))
+
+    def test_normalize(self):
+        images = np.array([0, 255], dtype=np.uint8)
+        np.testing.assert_allclose(preprocessing.normalize(images), [-1, 1])
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import dataset
+import recorder
+
+FRAME_SHAPE = (8, 4, 3)
+
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.recorder = recorder.Recorder(self.tmp_dir.name,
+                                          frame_shape=FRAME_SHAPE,
+                                          chunk_frames=4)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def record(self, count):
+        for i in range(count):
+            self.recorder.append(np.full(FRAME_SHAPE, i, dtype=np.uint8),
+                                 [i / 10.0, -i / 10.0], timestamp=float(i))
+
+    def test_nothing_written_until_recording(self):
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_save_session(self):
+        self.record(10)
+        self.assertEqual(len(self.recorder), 10)
+        session_path = self.recorder.save()
+        self.assertEqual(len(self.recorder), 0)
+        session = dataset.SessionReader(session_path)
+        self.assertEqual(len(session), 10)
+        self.assertEqual([frame[0, 0, 0] for frame in session.frames(range(10))],
+                         list(range(10)))
+        np.testing.assert_allclose(session.labels[:, 0], np.arange(10) / 10.0,
+                                   rtol=1e-6)
+        np.testing.assert_array_equal(session.timestamps, np.arange(10))
+        self.assertFalse(os.path.exists(self.recorder.pending_path))
+
+    def test_save_nothing(self):
+        self.assertIsNone(self.recorder.save())
+
+    def test_delete(self):
+        self.record(5)
+        self.recorder.delete()
+        self.assertEqual(len(self.recorder), 0)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        self.record(2)
+        session = dataset.SessionReader(self.recorder.save())
+        self.assertEqual(len(session), 2)
+
+    def test_saves_in_the_same_second(self):
+        self.record(2)
+        first = self.recorder.save()
+        self.record(3)
+        second = self.recorder.save()
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(dataset.SessionReader(first)), 2)
+        self.assertEqual(len(dataset.SessionReader(second)), 3)
+
+    def test_full_queue_drops_frames(self):
+        slow = recorder.Recorder(self.tmp_dir.name, frame_shape=FRAME_SHAPE,
+                                 write_queue=2)
+        blocked = threading.Event()
+        with patch.object(dataset.SessionWriter, 'append',
+                          side_effect=lambda *args: blocked.wait()):
+            dropped = slow.dropped.value
+            for i in range(5):
+                slow.append(np.zeros(FRAME_SHAPE, dtype=np.uint8), [0, 0])
+            # One frame in the writer, two queued, the rest dropped.
+            self.assertGreaterEqual(slow.dropped.value - dropped, 2)
+            self.assertEqual(len(slow) + slow.dropped.value - dropped, 5)
+            blocked.set()
+            slow.delete()
+
+    def test_uncommitted_recording_discarded(self):
+        self.record(3)
+        recorder.Recorder(self.tmp_dir.name, frame_shape=FRAME_SHAPE)
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
@@ -23,6 +23,7 @@ class TestCamera(unittest.TestCase):
         self.camera = robot_lib.Camera()
 
     def tearDown(self):
+        self.camera.stop()
         del self.camera
 
     def test_camera(self):
@@ -39,13 +40,48 @@ class TestCamera(unittest.TestCase):
         with self.assertRaises(asyncio.exceptions.TimeoutError):
             asyncio.run(get_image_coro)
 
+    def test_fresh_frame_each_call(self):
+        image_shape = (*robot_lib.CAMERA_RESOLUTION[::-1], 3)
+        self.camera.camera.read = Mock(return_value=(True, np.zeros(image_shape)))
+
+        async def get_two_frames():
+            first = await self.camera.get_frame()
+            second = await self.camera.get_frame(newer_than=first[0])
+            return first, second
+
+        first, second = asyncio.run(get_two_frames())
+        self.assertGreater(second[0], first[0])
+        self.assertGreaterEqual(second[1], first[1])
+
+    def test_unthreaded_camera(self):
+        self.camera.threaded = False
+        image_shape = (*robot_lib.CAMERA_RESOLUTION[::-1], 3)
+        self.camera.camera.read = Mock(return_value=(True, np.zeros(image_shape)))
+        image = asyncio.run(self.camera.get_image())
+        self.assertEqual(image.shape, image_shape)
+
+        async def get_frame_from_bus():
+            bus = robot_lib.frame_bus.FrameBus(self.camera, on_demand=True)
+            try:
+                return await bus.subscribe('test_unthreaded').get()
+            finally:
+                bus.stop()
+
+        frame = asyncio.run(get_frame_from_bus())
+        self.assertEqual(frame.image.shape, image_shape)
+        self.assertIsNone(self.camera.thread)
+
 
 class TestRobot(unittest.TestCase):
     @patch('robot_lib.cv2.VideoCapture')
     def setUp(self, mock_class=Mock()):
         self.robot = robot_lib.Robot()
+        # No frames unless a test provides them, the capture thread the
+        # frame bus starts just keeps retrying.
+        self.robot.camera.camera.read = Mock(return_value=(False, None))
 
     def tearDown(self):
+        self.robot.camera.stop()
         del self.robot
 
     def test_robot_camera(self):
@@ -74,6 +110,25 @@ class TestRobot(unittest.TestCase):
         self.assertEqual(base_speed, expected_base_speed)
         self.assertEqual(direction, expected_direction)
     
+    def test_post_request_binary(self):
+        image_shape = (*robot_lib.CAMERA_RESOLUTION[::-1], 3)
+        image = np.zeros(image_shape)
+        post = self.robot.post_request
+        expected_base_speed = 0.5
+        expected_direction = -0.25
+        read = CoroutineMock()
+        read.return_value = robot_lib.inference.encode_prediction(
+            expected_base_speed, expected_direction)
+        with patch('aiohttp.ClientSession.post') as mock_post:
+            response = mock_post.return_value.__aenter__.return_value
+            response.read = read
+            response.status = HTTPStatus.OK
+            response.content_type = robot_lib.inference.BINARY_CONTENT_TYPE
+            success, base_speed, direction = asyncio.run(post(image))
+        self.assertTrue(success)
+        self.assertEqual(base_speed, expected_base_speed)
+        self.assertEqual(direction, expected_direction)
+
     def test_post_request_fail(self):       
         image_shape = (*robot_lib.CAMERA_RESOLUTION[::-1], 3)
         image = np.zeros(image_shape)
@@ -95,10 +150,20 @@ class TestRobot(unittest.TestCase):
         com.get_message = get_message
         self.robot.com = com
     
+    def mock_ready(self, ready):
+        self.robot.inference.ready = CoroutineMock(return_value=ready)
+
     def test_process_events_engage(self):
         self.mock_get_message(message={'engage':''})
+        self.mock_ready(True)
         asyncio.run(self.robot.process_events())
         self.assertTrue(self.robot.autopilot_engaged)
+
+    def test_process_events_engage_model_not_ready(self):
+        self.mock_get_message(message={'engage':''})
+        self.mock_ready(False)
+        asyncio.run(self.robot.process_events())
+        self.assertFalse(self.robot.autopilot_engaged)
     
     def test_process_events_disengage(self):
         self.mock_get_message(message={'disengage':''})
@@ -109,14 +174,78 @@ class TestRobot(unittest.TestCase):
         self.mock_get_message(message={'a':1, 'b': 1})
         asyncio.run(self.robot.process_events())
     
+    def test_collect_data(self):
+        image_shape = (*robot_lib.CAMERA_RESOLUTION[::-1], 3)
+        self.robot.camera.camera.read = Mock(return_value=(True, np.zeros(image_shape)))
+        self.robot.data = Mock()
+        self.robot.drive(50, 30)
+        asyncio.run(self.robot.collect_data())
+        image, label, timestamp = self.robot.data.append.call_args[0]
+        self.assertEqual(image.shape, image_shape)
+        self.assertEqual(label, [0.5, 0.5])
+
+    def test_collect_data_labels_at_capture_time(self):
+        self.robot.data = Mock()
+        self.robot.commands.record((50, 30), timestamp=10.0)
+        self.robot.commands.record((0, 0), timestamp=20.0)
+        self.robot.record_frames.publish(robot_lib.frame_bus.Frame(1, 15.0, None))
+        asyncio.run(self.robot.collect_data())
+        image, label, timestamp = self.robot.data.append.call_args[0]
+        self.assertEqual(label, [0.5, 0.5])
+        self.assertEqual(timestamp, 15.0)
+
     def test_process_events_erase(self):
         self.mock_get_message(message={'erase':''})
         asyncio.run(self.robot.process_events())
 
+    def mock_autopilot(self, frame_times, latencies=(0.05, 0.2)):
+        frames = iter(frame_times)
+        latencies = iter(latencies)
+        get = CoroutineMock()
+        get.side_effect = lambda: robot_lib.frame_bus.Frame(0, next(frames), None)
+        self.robot.autopilot_frames.get = get
+
+        async def post_request(raw_image):
+            await asyncio.sleep(next(latencies))
+            return True, 0.5, 0.25
+
+        self.robot.post_request = post_request
+        self.robot.drive = Mock()
+        self.robot.autopilot_engaged = True
+
+    def test_autopilot_pipeline(self):
+        now = robot_lib.time.monotonic()
+        self.mock_autopilot([now, now])
+
+        async def two_ticks():
+            await self.robot.autopilot()
+            # The first frame is still being inferred while the second is
+            # captured.
+            self.assertFalse(self.robot.drive.called)
+            await self.robot.autopilot()
+
+        asyncio.run(two_ticks())
+        self.robot.drive.assert_called_once_with(50.0, 15.0)
+        self.assertEqual(len(self.robot.pipeline), 1)
+
+    def test_autopilot_sequential(self):
+        self.robot.pipeline_depth = 1
+        self.mock_autopilot([robot_lib.time.monotonic()])
+        asyncio.run(self.robot.autopilot())
+        self.robot.drive.assert_called_once_with(50.0, 15.0)
+
+    def test_autopilot_stale_prediction(self):
+        self.robot.pipeline_depth = 1
+        stale = robot_lib.time.monotonic() - self.robot.max_frame_age
+        self.mock_autopilot([stale])
+        asyncio.run(self.robot.autopilot())
+        self.assertFalse(self.robot.drive.called)
+
 
 class TestMotor(unittest.TestCase):
     def setUp(self):
-        self.motor = robot_lib.Motor('test_motor', 1, 2)
+        self.motor = robot_lib.Motor('test_motor', 1, 2,
+                                     robot_lib.motor_drivers.FakeDriver())
         self.motor.A = Mock()
         self.motor.B = Mock()
 
@@ -124,72 +253,101 @@ class TestMotor(unittest.TestCase):
         del self.motor
 
     def test_motor_stopped(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         self.motor.drive(0)
-        self.motor.A.start.assert_called_with(0)
-        self.motor.B.start.assert_called_with(0)
+        self.motor.A.set_duty_cycle.assert_called_with(0)
+        self.motor.B.set_duty_cycle.assert_called_with(0)
 
     def test_motor_max_speed(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         max_speed = robot_lib.MAX_PWM
         self.motor.drive(max_speed)
-        self.motor.A.start.assert_called_once_with(max_speed)
-        self.motor.B.start.assert_called_once_with(0)
+        self.motor.A.set_duty_cycle.assert_called_once_with(max_speed)
+        self.motor.B.set_duty_cycle.assert_called_once_with(0)
 
     def test_motor_over_max_speed(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         max_speed = robot_lib.MAX_PWM
         self.motor.drive(max_speed + 1)
-        self.motor.A.start.assert_called_once_with(max_speed)
-        self.motor.B.start.assert_called_once_with(0)
+        self.motor.A.set_duty_cycle.assert_called_once_with(max_speed)
+        self.motor.B.set_duty_cycle.assert_called_once_with(0)
 
     def test_motor_max_reverse(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         max_speed = robot_lib.MAX_PWM
         self.motor.drive(-max_speed)
-        self.motor.A.start.assert_called_once_with(0)
-        self.motor.B.start.assert_called_once_with(max_speed)
+        self.motor.A.set_duty_cycle.assert_called_once_with(0)
+        self.motor.B.set_duty_cycle.assert_called_once_with(max_speed)
 
     def test_motor_over_max_reverse(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         max_speed = robot_lib.MAX_PWM
         self.motor.drive(-max_speed - 1)
-        self.motor.A.start.assert_called_once_with(0)
-        self.motor.B.start.assert_called_once_with(max_speed)
+        self.motor.A.set_duty_cycle.assert_called_once_with(0)
+        self.motor.B.set_duty_cycle.assert_called_once_with(max_speed)
 
     def test_motor_under_max_speed(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         speed = robot_lib.MAX_PWM - 1
         self.motor.drive(speed)
-        self.motor.A.start.assert_called_once_with(speed)
-        self.motor.B.start.assert_called_once_with(0)
+        self.motor.A.set_duty_cycle.assert_called_once_with(speed)
+        self.motor.B.set_duty_cycle.assert_called_once_with(0)
 
     def test_motor_under_max_reverse(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         speed = robot_lib.MAX_PWM - 1
         self.motor.drive(-speed)
-        self.motor.A.start.assert_called_once_with(0)
-        self.motor.B.start.assert_called_once_with(speed)
+        self.motor.A.set_duty_cycle.assert_called_once_with(0)
+        self.motor.B.set_duty_cycle.assert_called_once_with(speed)
 
     def test_motor_under_min_speed(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         speed = robot_lib.MIN_PWM - 1
         self.motor.drive(speed)
-        self.motor.A.start.assert_called_once_with(0)
-        self.motor.B.start.assert_called_once_with(0)
+        self.motor.A.set_duty_cycle.assert_called_once_with(0)
+        self.motor.B.set_duty_cycle.assert_called_once_with(0)
 
     def test_motor_under_min_speed_reverse(self):
-        self.motor.A.start = MagicMock()
-        self.motor.B.start = MagicMock()
+        self.motor.A.set_duty_cycle = MagicMock()
+        self.motor.B.set_duty_cycle = MagicMock()
         speed = -robot_lib.MIN_PWM + 1
         self.motor.drive(speed)
-        self.motor.A.start.assert_called_once_with(0)
-        self.motor.B.start.assert_called_once_with(0)
+        self.motor.A.set_duty_cycle.assert_called_once_with(0)
+        self.motor.B.set_duty_cycle.assert_called_once_with(0)
+
+    def test_slew_rate(self):
+        self.motor.slew_rate = 200
+        self.motor.last_update -= 1
+        self.motor.drive(robot_lib.MAX_PWM)
+        # Ramped up over the slew interval, not the whole idle second.
+        self.motor.A.set_duty_cycle.assert_called_once_with(
+            200 * robot_lib.MOTOR_SLEW_INTERVAL)
+        self.motor.drive(0)
+        self.motor.A.set_duty_cycle.assert_called_with(0)
+
+
+class TestMotorDrivers(unittest.TestCase):
+    @patch.object(robot_lib.motor_drivers.GPIO, 'PWM')
+    def test_redundant_updates_skipped(self, pwm_class):
+        channel = robot_lib.motor_drivers.RPiGPIOChannel(1, 70)
+        channel.set_duty_cycle(50)
+        channel.set_duty_cycle(50)
+        channel.pwm.ChangeDutyCycle.assert_called_once_with(50)
+
+    def test_pigpio_uses_bcm_pins(self):
+        pi = Mock()
+        channel = robot_lib.motor_drivers.PigpioChannel(pi, 31, 70)
+        channel.set_duty_cycle(49.6)
+        pi.set_PWM_dutycycle.assert_called_with(6, 50)
+
+    def test_unknown_driver(self):
+        with self.assertRaises(ValueError):
+            robot_lib.motor_drivers.create_driver('servo')
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+
+import scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def run_for(self, seconds, step, enabled=lambda: True, rate=50):
+        self.scheduler = scheduler.Scheduler('test_scheduler', rate)
+
+        async def run():
+            task = asyncio.ensure_future(self.scheduler.run(step, enabled))
+            await asyncio.sleep(seconds)
+            task.cancel()
+
+        asyncio.run(run())
+
+    def test_runs_at_target_rate(self):
+        steps = []
+
+        async def step():
+            steps.append(1)
+
+        self.run_for(0.2, step)
+        # 10 ticks in 0.2 s at 50 Hz, not as fast as the loop can go.
+        self.assertGreaterEqual(len(steps), 8)
+        self.assertLessEqual(len(steps), 12)
+
+    def test_overruns_skip_ticks(self):
+        steps = []
+
+        async def slow_step():
+            steps.append(1)
+            await asyncio.sleep(0.05)
+
+        self.run_for(0.22, slow_step)
+        # Missed ticks are dropped, not run back to back.
+        self.assertLessEqual(len(steps), 5)
+        self.assertGreaterEqual(self.scheduler.overruns.value, 3)
+        self.assertGreaterEqual(self.scheduler.skipped_ticks.value, 3)
+
+    def test_failing_step(self):
+        steps = []
+        errors = []
+
+        async def failing_step():
+            steps.append(1)
+            raise RuntimeError('inference failed')
+
+        async def run():
+            self.scheduler = scheduler.Scheduler('test_scheduler_errors', 50)
+            task = asyncio.ensure_future(self.scheduler.run(
+                failing_step, on_error=lambda: errors.append(1)))
+            await asyncio.sleep(0.1)
+            self.assertFalse(task.done())
+            task.cancel()
+
+        asyncio.run(run())
+        # The schedule keeps going after a step raises.
+        self.assertGreaterEqual(len(steps), 3)
+        self.assertEqual(len(errors), len(steps))
+        self.assertEqual(self.scheduler.errors.value, len(steps))
+
+    def test_disabled(self):
+        steps = []
+
+        async def step():
+            steps.append(1)
+
+        self.run_for(0.1, step, enabled=lambda: False)
+        self.assertEqual(steps, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
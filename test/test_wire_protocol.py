@@ -0,0 +1,52 @@
+import unittest
+
+import wire_protocol
+
+
+class TestWireProtocol(unittest.TestCase):
+    def setUp(self):
+        self.parser = wire_protocol.BinaryParser()
+
+    def test_round_trip(self):
+        frame = wire_protocol.encode_command(
+            7, -0.5, 0.25, wire_protocol.FLAG_ENGAGE | wire_protocol.FLAG_ERASE)
+        self.assertEqual(len(frame), wire_protocol.FRAME_SIZE)
+        message, = self.parser.feed(frame)
+        self.assertAlmostEqual(message['a'], -0.5, places=4)
+        self.assertAlmostEqual(message['b'], 0.25, places=4)
+        self.assertEqual(message['seq'], 7)
+        self.assertEqual(message['engage'], 1)
+        self.assertEqual(message['erase'], 1)
+        self.assertNotIn('save', message)
+
+    def test_axes_are_clipped(self):
+        message = wire_protocol.decode_command(
+            wire_protocol.encode_command(0, 3.0, -3.0))
+        self.assertEqual((message['a'], message['b']), (1.0, -1.0))
+
+    def test_partial_frame(self):
+        frame = wire_protocol.encode_command(1, 0.1, 0.2)
+        self.assertEqual(self.parser.feed(frame[:4]), [])
+        self.assertEqual(len(self.parser.feed(frame[4:])), 1)
+        self.assertEqual(self.parser.buffer, b'')
+
+    def test_corrupted_frame_is_skipped(self):
+        bad = bytearray(wire_protocol.encode_command(1, 0.1, 0.2))
+        bad[3] ^= 0x40
+        good = wire_protocol.encode_command(2, 0.3, 0.4)
+        messages = self.parser.feed(b'\x00' + bytes(bad) + good)
+        self.assertEqual([message['seq'] for message in messages], [2])
+        self.assertEqual(self.parser.crc_errors, 1)
+
+    def test_dropped_packets_are_counted(self):
+        for sequence in (254, 255, 2, 3):
+            self.parser.feed(wire_protocol.encode_command(sequence, 0, 0))
+        self.assertEqual(self.parser.dropped, 2)
+
+    def test_smaller_than_json(self):
+        json_message = b'{"a":-0.0039215087890625,"b":0.0039215087890625}'
+        self.assertLessEqual(wire_protocol.FRAME_SIZE * 5, len(json_message))
+
+
+if __name__ == '__main__':
+    unittest.main()
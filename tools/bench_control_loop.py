@@ -0,0 +1,246 @@
+"""
+End to end benchmark of the agent control loop on fake hardware.
+
+Runs the real Robot, Camera, Communications and inference code against a
+fake RPi.GPIO, a synthetic (or recorded) video source and a pty standing in
+for the Xbee, and reports throughput, per stage latency percentiles and
+event loop lag as JSON:
+
+    python3 tools/bench_control_loop.py --duration 10 --output bench.json
+    python3 tools/bench_control_loop.py --compare bench.json
+
+With --compare the new run is printed next to an earlier one.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import fakes
+fakes.install()
+
+import communications
+import dataset
+import inference
+import metrics
+import motor_drivers
+import recorder
+import robot_lib
+
+LAG_INTERVAL = 0.01  # seconds
+
+
+def summarize(samples):
+    if not samples:
+        return {'count': 0}
+    values = np.array(samples) * 1000.0
+    return {'count': len(values),
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'p99_ms': float(np.percentile(values, 99)),
+            'max_ms': float(values.max())}
+
+
+class StageTimer():
+    """
+    Wraps methods of the objects under test and records their durations.
+    """
+    def __init__(self):
+        self.samples = {}
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap_async(self, obj, name, stage):
+        method = getattr(obj, name)
+
+        @functools.wraps(method)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        setattr(obj, name, timed)
+
+    def wrap(self, obj, name, stage):
+        method = getattr(obj, name)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        setattr(obj, name, timed)
+
+    def report(self):
+        return {stage: summarize(samples)
+                for stage, samples in sorted(self.samples.items())}
+
+
+async def measure_loop_lag(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, loop.time() - start - LAG_INTERVAL))
+
+
+async def run_serial(robot, stop):
+    while not stop.is_set():
+        await robot.process_events()
+
+
+async def run_autopilot(robot, stop, steps):
+    while not stop.is_set():
+        await robot.autopilot()
+        steps.append(time.perf_counter())
+
+
+async def run_collect(robot, stop, steps):
+    while not stop.is_set():
+        await robot.collect_data()
+        steps.append(time.perf_counter())
+
+
+def make_robot(args):
+    robot_lib.INFERENCE_CACHE = args.inference_cache
+    if args.source:
+        session = dataset.SessionReader(args.source)
+        source = session
+    else:
+        source = None
+    robot_lib.cv2.VideoCapture = lambda *a, **k: fakes.FakeVideoCapture(
+        fps=args.fps, source=source)
+    if args.backend == 'fake':
+        # The real LocalInference code path around a fixed latency model.
+        robot_lib.inference.load_predictor = \
+            lambda filename: fakes.FakePredictor(args.inference_latency)
+        robot = robot_lib.Robot(inference_backend='local',
+                                motor_driver=args.motor_driver)
+    else:
+        robot = robot_lib.Robot(inference_backend=args.backend,
+                                motor_driver=args.motor_driver)
+    return robot
+
+
+async def benchmark(args):
+    serial = fakes.PseudoSerial(rate=args.command_rate)
+    robot = make_robot(args)
+    robot.com = communications.Communications(serial_device=serial.device)
+    recording_dir = tempfile.TemporaryDirectory()
+    robot.data = recorder.Recorder(recording_dir.name)
+    timer = StageTimer()
+    timer.wrap_async(robot.autopilot_frames, 'get', 'capture')
+    timer.wrap_async(robot.record_frames, 'get', 'capture')
+    timer.wrap_async(robot, 'post_request', 'inference')
+    timer.wrap(robot, 'drive', 'motor_update')
+    timer.wrap_async(robot.com, 'get_message', 'serial_message')
+    timer.wrap(robot.data, 'append', 'record')
+
+    stop = asyncio.Event()
+    steps = []
+    lags = []
+    serial.start()
+    if args.mode == 'autopilot':
+        robot.autopilot_engaged = True
+        work = run_autopilot(robot, stop, steps)
+    else:
+        work = run_collect(robot, stop, steps)
+    tasks = [asyncio.ensure_future(coro) for coro in
+             (work, run_serial(robot, stop), measure_loop_lag(lags, stop))]
+    # Warm up (camera thread, first inference) before measuring.
+    await asyncio.sleep(args.warmup)
+    del steps[:]
+    del lags[:]
+    timer.samples.clear()
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    serial.stop()
+    robot.cleanup()
+    await robot.close()
+    recording_dir.cleanup()
+    return {'config': vars(args),
+            'commit': git_commit(),
+            'elapsed_s': elapsed,
+            'throughput_hz': len(steps) / elapsed,
+            'stages': timer.report(),
+            'event_loop_lag': summarize(lags),
+            'agent_metrics': metrics.snapshot()}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    rows = [('throughput_hz', baseline['throughput_hz'], report['throughput_hz'])]
+    for stage, stats in sorted(report['stages'].items()):
+        old = baseline['stages'].get(stage, {})
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            rows.append(('{}.{}'.format(stage, key), old.get(key), stats.get(key)))
+    for key in ('p50_ms', 'p99_ms'):
+        rows.append(('event_loop_lag.' + key, baseline['event_loop_lag'].get(key),
+                     report['event_loop_lag'].get(key)))
+    print('{:<32}{:>12}{:>12}'.format('', baseline.get('commit') or 'baseline',
+                                      report.get('commit') or 'current'))
+    for name, old, new in rows:
+        fmt = lambda value: '-' if value is None else '{:.2f}'.format(value)
+        print('{:<32}{:>12}{:>12}'.format(name, fmt(old), fmt(new)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--mode', choices=('autopilot', 'collect'),
+                        default='autopilot')
+    parser.add_argument('--backend', choices=['fake', *inference.BACKENDS],
+                        default='fake')
+    parser.add_argument('--motor-driver', choices=motor_drivers.DRIVERS,
+                        default='rpi_gpio',
+                        help='rpi_gpio runs against the fake RPi.GPIO module')
+    parser.add_argument('--inference-cache', action='store_true',
+                        help='reuse predictions for nearly identical frames')
+    parser.add_argument('--inference-latency', type=float, default=0.02,
+                        help='seconds per frame of the fake model')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--command-rate', type=float, default=20.0)
+    parser.add_argument('--source', help='recorded session to replay as video')
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='earlier JSON report to compare with')
+    args = parser.parse_args()
+
+    report = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
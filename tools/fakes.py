@@ -0,0 +1,150 @@
+"""
+Stand-ins for the tank hardware, so the real agent code can run on a PC.
+
+install() must be called before robot_lib is imported: it registers a fake
+RPi.GPIO module and puts src/ on the path.
+"""
+import os
+import pty
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+class FakePWM():
+    def __init__(self, pin, frequency):
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.updates = 0
+
+    def start(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self.updates += 1
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.start(duty_cycle)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.duty_cycle = 0
+
+
+def fake_gpio_module():
+    gpio = types.ModuleType('RPi.GPIO')
+    gpio.BOARD = 'BOARD'
+    gpio.BCM = 'BCM'
+    gpio.OUT = 'OUT'
+    gpio.IN = 'IN'
+    gpio.setmode = lambda mode: None
+    gpio.setwarnings = lambda flag: None
+    gpio.setup = lambda pins, mode: None
+    gpio.cleanup = lambda *args: None
+    gpio.PWM = FakePWM
+    return gpio
+
+
+def install():
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = fake_gpio_module()
+    sys.modules['RPi'] = rpi
+    sys.modules['RPi.GPIO'] = rpi.GPIO
+
+
+class FakeVideoCapture():
+    """
+    cv2.VideoCapture look-alike. read() blocks for one frame period like a
+    real driver and returns synthetic frames, or frames taken from
+    `source`, anything indexable returning (height, width, 3) uint8 arrays.
+    """
+    def __init__(self, fps=30, resolution=(320, 240), source=None):
+        self.fps = fps
+        self.width, self.height = resolution
+        self.source = source
+        self.frame_count = 0
+        self.next_frame_time = time.monotonic()
+
+    def set(self, prop, value):
+        return True
+
+    def get(self, prop):
+        return 0
+
+    def isOpened(self):
+        return True
+
+    def _synthetic_frame(self):
+        # A bright band sweeping sideways, like a track edge.
+        frame = np.full((self.height, self.width, 3), 40, dtype=np.uint8)
+        column = (self.frame_count * 4) % self.width
+        frame[:, column:column + 20] = 220
+        return frame
+
+    def read(self):
+        now = time.monotonic()
+        if self.next_frame_time > now:
+            time.sleep(self.next_frame_time - now)
+        self.next_frame_time = max(now, self.next_frame_time) + 1.0 / self.fps
+        if self.source is not None:
+            frame = self.source[self.frame_count % len(self.source)]
+        else:
+            frame = self._synthetic_frame()
+        self.frame_count += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class FakePredictor():
+    """
+    Model stand-in with a fixed compute time per frame.
+    """
+    def __init__(self, latency=0.02):
+        self.latency = latency
+
+    def __call__(self, batch):
+        time.sleep(self.latency * len(batch))
+        return np.tile([[0.5, 0.1]], (len(batch), 1)).astype(np.float32)
+
+
+class PseudoSerial():
+    """
+    A pty standing in for the Xbee. A background thread writes joystick
+    messages to it at `rate` Hz, the agent opens `device`.
+    """
+    def __init__(self, rate=20, message=b'{"a":-0.5,"b":0.1}'):
+        self.primary, self.secondary = pty.openpty()
+        self.device = os.ttyname(self.secondary)
+        self.rate = rate
+        self.message = message
+        self.sent = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._send, daemon=True)
+        self.thread.start()
+
+    def _send(self):
+        while self.running:
+            os.write(self.primary, self.message)
+            self.sent += 1
+            time.sleep(1.0 / self.rate)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.primary)
+        os.close(self.secondary)
@@ -0,0 +1,290 @@
+"""
+Offline replay of recorded sessions through the autopilot.
+
+Frames of every session found in the data directories (session_* and the
+older x_train_set/y_train_set pairs) go through the real Robot.autopilot,
+inference backend and Robot.drive on fake GPIO, and the predictions are
+compared with the labels the human driver recorded:
+
+    python3 tools/replay.py --backend local --model model_int8.tflite data/
+    python3 tools/replay.py --timing fast --batch-size 64 --model model.h5 data/
+
+With --timing recorded (the default) frames arrive at the pace they were
+recorded. With --timing fast they go through back to back, and with a
+--batch-size above 1 the model is loaded in this process and run on whole
+batches instead of through the robot, so a dataset is evaluated in
+seconds. The JSON report holds label agreement and per frame latency, and
+with --timing fast the highest sustained frame rate (max_fps). With recorded
+timing, late_frames and stale_predictions show whether the robot kept up.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import fakes
+fakes.install()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'desktop_side'))
+
+import bench_control_loop
+import data_pipeline
+import frame_bus
+import inference
+import preprocessing
+import robot_lib
+
+LEGACY_FPS = 5.0  # frames per second assumed for sessions without timestamps
+BATCH_SIZE = 1
+
+
+class NullRecorder():
+    """
+    Replays record nothing, and must not discard a pending recording in the
+    working directory the way a real Recorder does on start.
+    """
+    def append(self, image, label, timestamp=None):
+        pass
+
+    def save(self):
+        return None
+
+    def delete(self):
+        pass
+
+
+def session_times(session):
+    """
+    Seconds since the first frame for every frame of the session.
+    """
+    timestamps = getattr(session, 'timestamps', None)
+    if timestamps is None or not len(timestamps):
+        return np.arange(len(session)) / LEGACY_FPS
+    return np.asarray(timestamps, dtype=np.float64) - timestamps[0]
+
+
+class ReplayFeed():
+    """
+    Stands in for the robot's frame bus subscription, handing out the
+    session's frames either at their recorded pace or back to back.
+    """
+    def __init__(self, session, recorded_timing, speed=1.0):
+        self.session = session
+        self.times = session_times(session) / speed
+        self.recorded_timing = recorded_timing
+        self.preprocess = preprocessing.Preprocessor()
+        self.position = 0
+        self.start = None
+        self.late = []
+        self.waited = []
+
+    async def get(self):
+        i = self.position
+        self.position += 1
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        if self.recorded_timing:
+            due = self.start + self.times[i]
+            if due > now:
+                self.waited.append(due - now)
+                await asyncio.sleep(due - now)
+            else:
+                self.late.append(now - due)
+        image = self.preprocess(self.session[i])
+        return frame_bus.Frame(i, time.monotonic(), image)
+
+
+def make_robot(args):
+    robot_lib.recorder.Recorder = NullRecorder
+    robot_lib.cv2.VideoCapture = lambda *a, **k: fakes.FakeVideoCapture()
+    if args.backend == 'fake':
+        # The real LocalInference code path around a fixed latency model.
+        robot_lib.inference.load_predictor = \
+            lambda filename: fakes.FakePredictor(args.inference_latency)
+        return robot_lib.Robot(inference_backend='local', motor_driver='fake',
+                               pipeline_depth=args.pipeline_depth)
+    if args.backend != 'local':
+        return robot_lib.Robot(inference_backend=args.backend,
+                               motor_driver='fake',
+                               pipeline_depth=args.pipeline_depth)
+    # Robot would load the default model file, the http client is only a
+    # placeholder (it connects on first use) until --model is loaded.
+    robot = robot_lib.Robot(inference_backend='http', motor_driver='fake',
+                            pipeline_depth=args.pipeline_depth)
+    robot.inference = inference.create_backend('local',
+                                               model_filename=args.model)
+    return robot
+
+
+async def replay_session(robot, session, args, timer):
+    """
+    Predictions of the robot for every frame of the session, in order. A
+    row is NaN where inference failed.
+    """
+    predictions = []
+    act_on_prediction = robot._act_on_prediction
+
+    def record(timestamp, success, base_speed, direction):
+        if success:
+            predictions.append((base_speed, direction))
+        else:
+            predictions.append((np.nan, np.nan))
+        act_on_prediction(timestamp, success, base_speed, direction)
+
+    robot._act_on_prediction = record
+    feed = ReplayFeed(session, args.timing == 'recorded', args.speed)
+    robot.autopilot_frames = feed
+    robot.autopilot_engaged = True
+    start = time.perf_counter()
+    for _ in range(len(session)):
+        await robot.autopilot()
+        timer.record('step', time.perf_counter() - start)
+        start = time.perf_counter()
+    # Frames still being inferred when the session ran out.
+    while robot.pipeline:
+        timestamp, task = robot.pipeline.popleft()
+        robot._act_on_prediction(timestamp, *await task)
+    robot._act_on_prediction = act_on_prediction
+    robot.autopilot_engaged = False
+    robot.stop()
+    timer.samples.setdefault('late_frames', []).extend(feed.late)
+    timer.samples.setdefault('waiting_for_frame', []).extend(feed.waited)
+    return np.array(predictions, dtype=np.float64).reshape(-1, 2)
+
+
+async def replay_robot(sessions, args):
+    robot = make_robot(args)
+    timer = bench_control_loop.StageTimer()
+    timer.wrap_async(robot, 'post_request', 'inference')
+    timer.wrap(robot, 'drive', 'motor_update')
+    stale = robot.stale_predictions.value
+    failed = robot.failed_inferences.value
+    results = []
+    start = time.perf_counter()
+    try:
+        for session in sessions:
+            results.append(await replay_session(robot, session, args, timer))
+    finally:
+        elapsed = time.perf_counter() - start
+        robot.cleanup()
+        await robot.close()
+    report = {'elapsed_s': elapsed,
+              'stages': timer.report(),
+              'stale_predictions': robot.stale_predictions.value - stale,
+              'failed_inferences': robot.failed_inferences.value - failed}
+    return results, report
+
+
+def replay_batched(sessions, args):
+    """
+    Runs the model directly on whole batches, read and preprocessed ahead by
+    the training input pipeline.
+    """
+    if args.backend == 'fake':
+        predictor = fakes.FakePredictor(args.inference_latency)
+    else:
+        predictor = inference.load_predictor(args.model)
+        inference.warmup(predictor)
+    timings = []
+    results = []
+    start = time.perf_counter()
+    for session in sessions:
+        stream = data_pipeline.BatchStream(
+            [data_pipeline.Segment(session, 0, len(session))],
+            batch_size=args.batch_size, shuffle=False)
+        predictions = []
+        try:
+            for X, y in stream.epoch():
+                batch_start = time.perf_counter()
+                predictions.append(np.asarray(predictor(X), dtype=np.float64))
+                per_frame = (time.perf_counter() - batch_start) / len(X)
+                timings.extend([per_frame] * len(X))
+        finally:
+            stream.close()
+        results.append(np.concatenate(predictions).reshape(-1, 2))
+    elapsed = time.perf_counter() - start
+    report = {'elapsed_s': elapsed,
+              'stages': {'inference': bench_control_loop.summarize(timings)}}
+    return results, report
+
+
+def agreement(predictions, labels):
+    """
+    How closely the autopilot follows the human driver on the same frames.
+    """
+    valid = ~np.isnan(predictions).any(axis=1)
+    predictions = predictions[valid]
+    labels = labels[valid]
+    if not len(predictions):
+        return {'frames': 0}
+    error = predictions - labels
+    same_direction = np.sign(predictions[:, 1]) == np.sign(labels[:, 1])
+    return {'frames': int(len(predictions)),
+            'mean_abs_error': np.abs(error).mean(axis=0).tolist(),
+            'mse': (error ** 2).mean(axis=0).tolist(),
+            'direction_sign_agreement': float(same_direction.mean())}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_dirs', nargs='*', default=['.'],
+                        help='directories holding recorded sessions')
+    parser.add_argument('--backend', choices=['fake', *inference.BACKENDS],
+                        default='local')
+    parser.add_argument('--model', default=inference.MODEL_FILENAME,
+                        help='model for the local backend and batched replay')
+    parser.add_argument('--timing', choices=('recorded', 'fast'),
+                        default='recorded')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed with recorded timing')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='with --timing fast, above 1 runs the model '
+                             'directly on batches')
+    parser.add_argument('--pipeline-depth', type=int,
+                        default=robot_lib.AUTOPILOT_PIPELINE_DEPTH)
+    parser.add_argument('--inference-latency', type=float, default=0.02,
+                        help='seconds per frame of the fake model')
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    sessions = data_pipeline.discover_sessions(args.data_dirs)
+    if not sessions:
+        parser.error('No recorded sessions found in {}'.format(args.data_dirs))
+    batched = args.timing == 'fast' and args.batch_size > 1
+    if batched and args.backend not in ('fake', 'local'):
+        parser.error('Batched replay runs the model itself, use --backend local')
+    if batched:
+        results, report = replay_batched(sessions, args)
+    else:
+        results, report = asyncio.run(replay_robot(sessions, args))
+
+    frames = sum(len(session) for session in sessions)
+    labels = np.concatenate([np.asarray(session.labels, dtype=np.float64)
+                             for session in sessions])
+    predictions = np.concatenate(results)
+    report.update({'config': vars(args),
+                   'commit': bench_control_loop.git_commit(),
+                   'sessions': [{'path': session.path,
+                                 'frames': len(session),
+                                 'agreement': agreement(result, np.asarray(
+                                     session.labels, dtype=np.float64))}
+                                for session, result in zip(sessions, results)],
+                   'frames': frames,
+                   'agreement': agreement(predictions, labels),
+                   'fps': frames / report['elapsed_s']})
+    if args.timing == 'fast':
+        # Nothing waits for the recording, so this is as fast as it goes.
+        report['max_fps'] = report['fps']
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()